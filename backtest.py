@@ -0,0 +1,311 @@
+# backtest.py
+"""
+Пошаговый прогон конвейера predictor.analyze по истории из kline_store (сеть не нужна).
+
+    python backtest.py --tf 1                          # все символы из train_models, все бары
+    python backtest.py --tf 5 --bars 100000 --weights sweep.json --output backtest.json
+
+На каждом баре t воспроизводится то, что analyze увидел бы сразу после его закрытия:
+признаки -> CandleModel, паттерны + scalping_strategy, тренд, режим рынка по окну из
+WINDOW свечей и итоговое взвешивание predictor.blend. Все ряды считаются векторно один
+раз на символ, после чего любое число наборов весов оценивается почти бесплатно.
+
+Grok не вызывается: его вероятность — константа --grok (0.5, как при отключённом Grok)
+или значения из --grok-replay, JSON вида {"BTCUSD": {"<время бара>": 0.62, ...}}.
+
+sweep.json — список наборов весов; набор — либо [ml, patterns, trend, grok] для всех
+режимов, либо словарь как predictor.BLEND_WEIGHTS (недостающие ключи берутся оттуда).
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from config import FLAT_FOREST_MAX_ROWS
+from features import build_features
+from indicators import compute_indicator_series, scalping_strategy
+from model_registry import get_model
+from patterns import PATTERNS, scan_patterns
+from predictor import BLEND_WEIGHTS, blend, blend_weights
+from train_models import SYMBOLS, TIMEFRAMES, load_candles
+from trend import trend_signal_series, market_regime_series
+
+WINDOW = 70             # столько свечей analyze запрашивает у провайдера
+REGIMES = ("trend", "flat", "volatile")
+CALIBRATION_BINS = 10
+
+_BB = {1: "overbought", -1: "oversold", 0: "neutral"}
+_PSAR = {1: "up", -1: "down", 0: "neutral"}
+
+def _window_ema(closes, window=20, period=9):
+    """compute_ema(closes[-window:]) для каждого бара: EMA, начатая заново с начала окна."""
+    out = np.zeros(len(closes))
+    if len(closes) < window:
+        return out
+    alpha = 2 / (period + 1)
+    k = np.arange(window - 1, -1, -1)  # возраст свечи в окне
+    weights = alpha * (1 - alpha) ** k
+    weights[0] = (1 - alpha) ** (window - 1)  # первая свеча окна — затравка EMA
+    out[window - 1:] = np.lib.stride_tricks.sliding_window_view(closes, window) @ weights
+    return out
+
+def _window_psar(highs, lows, window=WINDOW, af_step=0.015, af_max=0.2):
+    """
+    compute_parabolic_sar по последним window свечам для каждого бара (1 — up, -1 — down):
+    тот же цикл, что и в indicators, но сразу для всех окон — window шагов по векторам.
+    """
+    out = np.zeros(len(highs), dtype=np.int8)
+    if len(highs) < max(window, 2):
+        return out
+    h = np.lib.stride_tricks.sliding_window_view(np.asarray(highs, dtype=float), window)
+    l = np.lib.stride_tricks.sliding_window_view(np.asarray(lows, dtype=float), window)
+    sar, ep = l[:, 0].copy(), h[:, 0].copy()
+    af = np.full(len(h), 0.015)
+    up = np.ones(len(h), dtype=bool)
+    for i in range(1, window):
+        sar = sar + af * (ep - sar)
+        hi, lo = h[:, i], l[:, i]
+        flip = np.where(up, lo < sar, hi > sar)
+        extend = ~flip & np.where(up, hi > ep, lo < ep)
+        sar = np.where(flip, ep, sar)
+        ep = np.where(flip | extend, np.where(up ^ flip, hi, lo), ep)
+        af = np.where(flip, 0.015, np.where(extend, np.minimum(af + af_step, af_max), af))
+        up ^= flip
+    out[window - 1:] = np.where(up, 1, -1)
+    return out
+
+def _predict(model, X):
+    """
+    predict_proba всех строк в один поток: символы и так считаются в отдельных процессах.
+    FlatForest — пакетами по FLAT_FOREST_MAX_ROWS (иначе CandleModel уйдёт в sklearn),
+    без него — sklearn-лес с n_jobs=1 вместо сохранённого потока на ядро.
+    """
+    model.set_n_jobs(1)
+    if model.flat is None:
+        return model.predict_proba(X)
+    step = FLAT_FOREST_MAX_ROWS
+    return np.concatenate([model.predict_proba(X[i:i + step]) for i in range(0, len(X), step)])
+
+def replay(candles, tf, horizon=2, grok=0.5):
+    """
+    Компоненты analyze по барам t = WINDOW-1 .. n-1-horizon и исход через horizon баров.
+    grok — число или массив вероятностей Grok той же длины, что candles.
+    """
+    n = len(candles)
+    bars = np.arange(WINDOW - 1, n - horizon)
+    if len(bars) == 0:
+        return None
+    closes, highs, lows = candles["close"], candles["high"], candles["low"]
+
+    # analyze видит только последние WINDOW свечей: рекурсивные EMA и SAR начинаются
+    # с начала окна, остальные индикаторы короче окна и совпадают с рядами по всей истории
+    ind = compute_indicator_series(closes, highs, lows)
+    ind["ema"][WINDOW - 1:] = _window_ema(np.asarray(closes, dtype=float), WINDOW)[WINDOW - 1:]
+    ind["psar"] = _window_psar(highs, lows)
+
+    # build_features отбрасывает первый бар: признаки бара t — строка t - 1
+    X = build_features(candles, tf, ind)
+    ml = _predict(get_model(tf), X[bars - 1])  # [prob_down, prob_neutral, prob_up]
+
+    flags, pattern_score = scan_patterns(candles)
+    trend = trend_signal_series(candles)
+    regime = market_regime_series(candles, WINDOW)
+
+    # Индикаторы как в IndicatorStream.snapshot (EMA — по последним 20 свечам, SAR — по окну)
+    ema = _window_ema(np.asarray(closes, dtype=float))
+    adj = np.empty(len(bars))
+    columns = {name: ind[name][bars].tolist() for name in ("rsi", "macd", "bb", "stoch", "adx", "atr", "cci", "psar")}
+    for j, t in enumerate(bars.tolist()):
+        indicators = {
+            "rsi": columns["rsi"][j], "macd": columns["macd"][j], "bb": _BB[columns["bb"][j]],
+            "ema": ema[t], "closes": closes[t:t + 1], "stoch": columns["stoch"][j],
+            "adx": columns["adx"][j], "atr": columns["atr"][j], "cci": columns["cci"][j],
+            "psar": _PSAR[columns["psar"][j]],
+        }
+        patterns = [PATTERNS[i] for i in np.flatnonzero(flags[t])]
+        adj[j] = scalping_strategy(indicators, patterns, regime[t])
+
+    return {
+        "time": candles["time"][bars],
+        "ml_up": ml[:, 2],
+        "ml_down": ml[:, 0],
+        "pattern_score": np.clip(pattern_score[bars] + adj, 0.0, 1.0),
+        "trend": trend[bars],
+        "regime": regime[bars],
+        "grok": np.broadcast_to(np.asarray(grok, dtype=float), (n,))[bars],
+        "future_return": closes[bars + horizon] / closes[bars] - 1,
+    }
+
+def _weight_table(weights):
+    if isinstance(weights, dict):
+        return {**BLEND_WEIGHTS, **weights}
+    return {key: list(weights) for key in BLEND_WEIGHTS}
+
+def evaluate(components, tf, weights=BLEND_WEIGHTS, min_edge=0.0):
+    """Суммы для метрик (их можно складывать между символами)."""
+    table = _weight_table(weights)
+    codes = np.full(len(components["regime"]), REGIMES.index("volatile"))
+    for i, name in enumerate(REGIMES):
+        codes[components["regime"] == name] = i
+    W = np.array([blend_weights(tf, name, table) for name in REGIMES])[codes]
+
+    _, _, prob = blend(W, components["ml_up"], components["ml_down"], components["pattern_score"],
+                       components["trend"], components["grok"])
+    prob = np.clip(prob, 0.0, 1.0)
+    ret = components["future_return"]
+    up = (ret > 0).astype(float)
+
+    signal = np.abs(prob - 0.5) >= max(min_edge, 1e-12)
+    hit = signal & (((prob > 0.5) & (ret > 0)) | ((prob < 0.5) & (ret < 0)))
+
+    bins = np.minimum((prob * CALIBRATION_BINS).astype(int), CALIBRATION_BINS - 1)
+    return {
+        "bars": len(prob),
+        "signals": int(signal.sum()),
+        "hits": int(hit.sum()),
+        "brier_sum": float(((prob - up) ** 2).sum()),
+        "bin_count": np.bincount(bins, minlength=CALIBRATION_BINS).tolist(),
+        "bin_prob": np.bincount(bins, weights=prob, minlength=CALIBRATION_BINS).tolist(),
+        "bin_up": np.bincount(bins, weights=up, minlength=CALIBRATION_BINS).tolist(),
+    }
+
+def _merge(totals, part):
+    if totals is None:
+        return part
+    for key, value in part.items():
+        totals[key] = [a + b for a, b in zip(totals[key], value)] if isinstance(value, list) else totals[key] + value
+    return totals
+
+def summarize(totals):
+    bars = totals["bars"]
+    calibration = [
+        {
+            "bin": f"{i / CALIBRATION_BINS:.1f}-{(i + 1) / CALIBRATION_BINS:.1f}",
+            "count": count,
+            "mean_prob": round(totals["bin_prob"][i] / count, 4),
+            "up_rate": round(totals["bin_up"][i] / count, 4),
+        }
+        for i, count in enumerate(totals["bin_count"]) if count
+    ]
+    return {
+        "bars": bars,
+        "signals": totals["signals"],
+        "hit_rate": round(totals["hits"] / totals["signals"], 4) if totals["signals"] else None,
+        "brier": round(totals["brier_sum"] / bars, 5) if bars else None,
+        "calibration": calibration,
+    }
+
+def _load_grok_replay(path, symbol, times, default):
+    if not path:
+        return default
+    with open(path) as f:
+        probs = json.load(f).get(symbol, {})
+    return np.array([probs.get(str(t), default) for t in times.tolist()], dtype=float)
+
+def run_symbol(symbol, tf, bars=None, horizon=2, weight_sets=(BLEND_WEIGHTS,), grok=0.5, grok_replay=None, min_edge=0.0):
+    """Один символ целиком (выполняется в отдельном процессе)."""
+    logging.getLogger().setLevel(logging.WARNING)
+    started = time.perf_counter()
+    candles = load_candles(symbol, tf, bars)  # бары tf из истории BASE_INTERVAL, в памяти процесса
+
+    components = replay(candles, tf, horizon, _load_grok_replay(grok_replay, symbol, candles["time"], grok))
+    replayed = time.perf_counter() - started
+    if components is None:
+        return {"symbol": symbol, "bars": 0, "replay_seconds": replayed, "results": []}
+    results = [evaluate(components, tf, w, min_edge) for w in weight_sets]
+    return {
+        "symbol": symbol,
+        "bars": len(components["time"]),
+        "replay_seconds": replayed,
+        "evaluate_seconds": time.perf_counter() - started - replayed,
+        "results": results,
+    }
+
+def run(symbols, tf, bars=None, horizon=2, weight_sets=(BLEND_WEIGHTS,), grok=0.5, grok_replay=None,
+        min_edge=0.0, workers=None):
+    started = time.perf_counter()
+    workers = workers or min(len(symbols), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            symbol: pool.submit(run_symbol, symbol, tf, bars, horizon, list(weight_sets), grok, grok_replay, min_edge)
+            for symbol in symbols
+        }
+        per_symbol = {}
+        for symbol, future in futures.items():
+            try:
+                per_symbol[symbol] = future.result()
+            except Exception as e:
+                logging.error(f"Бэктест {symbol}: {e}")
+    elapsed = time.perf_counter() - started
+
+    totals = [None] * len(weight_sets)
+    for res in per_symbol.values():
+        for i, part in enumerate(res["results"]):
+            totals[i] = _merge(totals[i], dict(part))
+    total_bars = sum(res["bars"] for res in per_symbol.values())
+
+    return {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "tf": tf,
+            "horizon": horizon,
+            "min_edge": min_edge,
+            "workers": workers,
+            "seconds": round(elapsed, 3),
+            "bars_per_second": round(total_bars / elapsed, 1) if elapsed else None,
+        },
+        "weight_sets": [
+            {"weights": _weight_table(w), **(summarize(t) if t else {})}
+            for w, t in zip(weight_sets, totals)
+        ],
+        "symbols": {
+            symbol: {
+                "bars": res["bars"],
+                "replay_seconds": round(res["replay_seconds"], 3),
+                "hit_rate": summarize(res["results"][0])["hit_rate"] if res["results"] else None,
+            }
+            for symbol, res in per_symbol.items()
+        },
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пошаговый бэктест конвейера анализа")
+    parser.add_argument("--tf", default="1", choices=TIMEFRAMES)
+    parser.add_argument("--symbols", nargs="+", default=SYMBOLS)
+    parser.add_argument("--bars", type=int, help="только последние N баров каждого символа")
+    parser.add_argument("--horizon", type=int, default=2, help="через сколько баров проверяется прогноз")
+    parser.add_argument("--weights", help="JSON со списком наборов весов для перебора")
+    parser.add_argument("--grok", type=float, default=0.5, help="вероятность Grok вместо запроса")
+    parser.add_argument("--grok-replay", help="JSON с сохранёнными ответами Grok по барам")
+    parser.add_argument("--min-edge", type=float, default=0.0, help="сигнал, только если |prob - 0.5| >= min-edge")
+    parser.add_argument("--workers", type=int, help="процессов (по умолчанию — по числу ядер)")
+    parser.add_argument("--output", help="куда записать отчёт (JSON)")
+    args = parser.parse_args(argv)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    weight_sets = [BLEND_WEIGHTS]
+    if args.weights:
+        with open(args.weights) as f:
+            weight_sets = json.load(f)
+
+    report = run(args.symbols, args.tf, args.bars, args.horizon, weight_sets, args.grok, args.grok_replay,
+                 args.min_edge, args.workers)
+
+    meta = report["meta"]
+    print(f"{meta['tf']}m, горизонт {meta['horizon']}: {meta['seconds']} с, {meta['bars_per_second']} бар/с")
+    for i, res in enumerate(report["weight_sets"]):
+        print(f"  набор {i}: сигналов {res.get('signals', 0)}, hit rate {res.get('hit_rate')}, Brier {res.get('brier')}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Отчёт записан в {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+# bar_cache.py
+import asyncio
+import time
+
+_UNITS = {"min": 60, "m": 60, "h": 3600, "day": 86400, "d": 86400}
+
+def interval_seconds(interval: str) -> int:
+    """'1m' / '5min' / '1h' / '1day' -> длительность бара в секундах."""
+    interval = interval.strip().lower()
+    for unit in sorted(_UNITS, key=len, reverse=True):
+        if interval.endswith(unit):
+            return int(interval[:-len(unit)] or 1) * _UNITS[unit]
+    raise ValueError(f"Неизвестный интервал: {interval}")
+
+def next_bar_close(interval: str, now: float = None) -> float:
+    """Момент закрытия текущего бара (бары выровнены по UTC-эпохе)."""
+    step = interval_seconds(interval)
+    now = time.time() if now is None else now
+    return (now // step + 1) * step
+
+
+class SingleFlightCache:
+    """
+    Кэш с индивидуальным временем жизни записей.
+    Одновременные промахи по одному ключу ждут одну и ту же загрузку (loader — корутина).
+    expires_at — момент истечения или функция от загруженного значения, возвращающая его.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._entries = {}   # key -> (expires_at, value)
+        self._inflight = {}  # key -> asyncio.Task
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def get_or_load(self, key, loader, expires_at):
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.time():
+            self.hits += 1
+            return entry[1]
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self._load(key, loader, expires_at))
+            # Исключение забирается здесь, даже если все ожидающие уже отменены
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._inflight[key] = task
+        else:
+            self.coalesced += 1
+        # shield: отмена одного ожидающего не отменяет загрузку для остальных
+        return await asyncio.shield(task)
+
+    async def _load(self, key, loader, expires_at):
+        try:
+            value = await loader()
+            if callable(expires_at):
+                expires_at = expires_at(value)
+            self._prune()
+            self._entries[key] = (expires_at, value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def _prune(self):
+        now = time.time()
+        for k in [k for k, (exp, _) in self._entries.items() if exp <= now]:
+            del self._entries[k]
+
+    def clear(self):
+        self._entries.clear()
+
+    def discard(self, predicate):
+        """Удалить записи, для ключей которых predicate(key) истинно (идущие загрузки не трогаются)."""
+        for k in [k for k in self._entries if predicate(k)]:
+            del self._entries[k]
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
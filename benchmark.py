@@ -0,0 +1,240 @@
+# benchmark.py
+"""
+Офлайн-бенчмарк конвейера анализа на синтетических данных (сеть не нужна).
+
+    python benchmark.py                       # замер и запись bench_baseline.json
+    python benchmark.py --compare bench_baseline.json --tolerance 0.25
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import data_provider
+from candle_array import from_columns
+import grok_client
+import indicators
+import predictor
+from cv_extractor import extract_candles, extract_cache
+from features import build_features
+from keyboards import MARKET_CATEGORIES
+from forest import FlatForest
+from model_registry import get_model
+from patterns import detect_patterns, scan_patterns
+from trend import market_regime
+
+DEFAULT_SIZES = [70, 500, 2000]
+DEFAULT_OUTPUT = "bench_baseline.json"
+
+def synthetic_candles(n: int, seed: int = 42, start_price: float = 100.0, step: int = 60):
+    """Случайное блуждание OHLCV с реалистичными тенями."""
+    rng = np.random.default_rng(seed)
+    closes = start_price * np.exp(np.cumsum(rng.normal(0, 0.002, n)))
+    opens = np.concatenate(([start_price], closes[:-1]))
+    spread = np.abs(rng.normal(0, 0.001, n)) * closes
+    highs = np.maximum(opens, closes) + spread
+    lows = np.minimum(opens, closes) - spread
+    volumes = rng.uniform(10, 1000, n)
+    t0 = int(time.time() // step - n) * step
+    return from_columns(opens, highs, lows, closes, volumes, time=t0 + np.arange(n) * step)
+
+def synthetic_screenshot(n: int = 60, width: int = 1080, height: int = 1920, seed: int = 7) -> bytes:
+    """PNG «скриншот» графика: тёмный фон, панели сверху/снизу, n свечей с тенями."""
+    candles = synthetic_candles(n, seed=seed)
+    img = np.full((height, width, 3), 24, np.uint8)
+    img[: int(height * 0.06)] = 60
+    img[int(height * 0.94):] = 60
+    top, bottom = int(height * 0.2), int(height * 0.8)
+    lo = candles["low"].min()
+    hi = candles["high"].max()
+    y = lambda p: int(bottom - (p - lo) / (hi - lo) * (bottom - top))
+    slot = width * 0.9 / n
+    for i, c in enumerate(candles):
+        x = int(width * 0.05 + i * slot)
+        color = (80, 200, 80) if c["close"] >= c["open"] else (60, 60, 220)
+        cv2.line(img, (x + int(slot / 3), y(c["high"])), (x + int(slot / 3), y(c["low"])), color, 1)
+        y0, y1 = sorted((y(c["open"]), y(c["close"])))
+        cv2.rectangle(img, (x, y0), (x + max(int(slot * 0.66), 2), max(y1, y0 + 2)), color, -1)
+    ok, buf = cv2.imencode(".png", img)
+    return buf.tobytes()
+
+def synthetic_forest(X: np.ndarray, n_estimators: int = 400, max_depth: int = 12, seed: int = 3):
+    """Лес размера боевых моделей, обученный на признаках синтетических свечей."""
+    from sklearn.ensemble import RandomForestClassifier
+    rng = np.random.default_rng(seed)
+    y = rng.choice([-1, 0, 1], size=len(X))
+    return RandomForestClassifier(n_estimators=n_estimators, max_depth=max_depth, min_samples_split=8,
+                                  class_weight="balanced", random_state=seed, n_jobs=-1).fit(X, y)
+
+def install_stubs(candles):
+    """Подменяет Twelve Data, Binance и xAI на локальные заглушки."""
+    async def fake_binance(symbol, interval="1m", limit=70, start_time=None):
+        return candles[-limit:]
+
+    class FakeTwelveData:
+        async def get_candles(self, symbol, interval, outputsize=50):
+            return candles[-outputsize:]
+
+    async def fake_grok(prompt):
+        return 0.55
+
+    data_provider.get_candles_binance = fake_binance
+    data_provider.get_client = lambda: FakeTwelveData()
+    grok_client._request = fake_grok
+    grok_client.XAI_API_KEY = "benchmark"
+
+def clear_caches():
+    data_provider.candle_cache.clear()
+    predictor.analysis_cache.clear()
+    grok_client.grok_cache.clear()
+    extract_cache.clear()
+
+def measure(fn, repeat: int, warmup: int = 1) -> dict:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        "median_ms": round(statistics.median(samples), 4),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 4),
+        "min_ms": round(samples[0], 4),
+        "repeat": repeat,
+    }
+
+def run(sizes, repeat: int) -> dict:
+    results = {}
+    loop = asyncio.new_event_loop()
+
+    def bench(name, fn, n=repeat):
+        results[name] = measure(fn, n)
+        print(f"{name:<40} {results[name]['median_ms']:>10.3f} ms")
+
+    shot = synthetic_screenshot()
+    def extract_cold():
+        extract_cache.clear()
+        extract_candles(shot)
+
+    bench("extract_candles[1080x1920]", extract_cold, max(3, repeat // 5))
+    bench("extract_candles[cached]", lambda: extract_candles(shot))
+
+    for size in sizes:
+        candles = synthetic_candles(size)
+        closes, highs, lows = candles["close"], candles["high"], candles["low"]
+
+        bench(f"build_features[{size}]", lambda: build_features(candles, "1"))
+        bench(f"indicator_series[{size}]", lambda: indicators.compute_indicator_series(closes, highs, lows))
+        bench(f"rsi[{size}]", lambda: indicators.compute_rsi(closes))
+        bench(f"macd[{size}]", lambda: indicators.compute_macd(closes))
+        bench(f"bollinger[{size}]", lambda: indicators.compute_bollinger(closes))
+        bench(f"ema[{size}]", lambda: indicators.compute_ema(closes))
+        bench(f"stochastic[{size}]", lambda: indicators.compute_stochastic(closes, highs, lows))
+        bench(f"adx[{size}]", lambda: indicators.compute_adx_strength(highs, lows, closes))
+        bench(f"atr[{size}]", lambda: indicators.compute_atr(highs, lows, closes))
+        bench(f"cci[{size}]", lambda: indicators.compute_cci(highs, lows, closes))
+        bench(f"parabolic_sar[{size}]", lambda: indicators.compute_parabolic_sar(highs, lows, closes))
+        bench(f"detect_patterns[{size}]", lambda: detect_patterns(candles))
+        bench(f"scan_patterns[{size}]", lambda: scan_patterns(candles))
+        bench(f"market_regime[{size}]", lambda: market_regime(candles))
+
+        X = build_features(candles, "1")
+        model = get_model("1")
+        bench(f"predict_proba[{size}x1]", lambda: model.predict_proba(X[-1:]))
+        bench(f"predict_proba[{size}x{len(X)}]", lambda: model.predict_proba(X))
+
+        install_stubs(candles)
+
+        def full_analyze():
+            clear_caches()
+            res, err = loop.run_until_complete(predictor.analyze(tf="1", symbol="BTCUSD"))
+            assert err is None, err
+
+        bench(f"analyze[{size}]", full_analyze)
+
+        def full_scan():
+            clear_caches()
+            res, err = loop.run_until_complete(predictor.scan(MARKET_CATEGORIES["crypto"], tf="1"))
+            assert err is None, err
+
+        bench(f"scan[{size}x{len(MARKET_CATEGORIES['crypto'])}]", full_scan)
+
+    # Инференс леса: sklearn против развёрнутого в массивы FlatForest (вероятности совпадают)
+    X = build_features(synthetic_candles(5000), "1")
+    forest = synthetic_forest(X)
+    flat = FlatForest.from_sklearn(forest)
+    assert np.allclose(forest.predict_proba(X[-256:]), flat.predict_proba(X[-256:]))
+    for rows in (1, 70):
+        bench(f"forest_sklearn[{rows}]", lambda: forest.predict_proba(X[-rows:]))
+        bench(f"forest_flat[{rows}]", lambda: flat.predict_proba(X[-rows:]))
+
+    def screenshot_analyze():
+        clear_caches()
+        loop.run_until_complete(predictor.analyze(tf="1", image_bytes=shot))
+
+    bench("analyze[screenshot]", screenshot_analyze, max(3, repeat // 5))
+    loop.close()
+    return results
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list:
+    """Стадии, чья медиана выросла больше чем на tolerance (доля) относительно базы."""
+    regressions = []
+    for name, base in baseline.get("results", {}).items():
+        cur = current["results"].get(name)
+        if cur is None or base["median_ms"] <= 0:
+            continue
+        ratio = cur["median_ms"] / base["median_ms"]
+        if ratio > 1 + tolerance:
+            regressions.append((name, base["median_ms"], cur["median_ms"], ratio))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк конвейера анализа")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="размеры окна свечей")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="куда записать результаты (JSON)")
+    parser.add_argument("--compare", help="базовый JSON для проверки регрессий")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="допустимое замедление, доля")
+    args = parser.parse_args(argv)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    report = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "sizes": args.sizes,
+        },
+        "results": run(args.sizes, args.repeat),
+    }
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        for name, base, cur, ratio in regressions:
+            print(f"РЕГРЕССИЯ {name}: {base:.3f} -> {cur:.3f} ms (x{ratio:.2f})")
+        if regressions:
+            return 1
+        print("Регрессий нет")
+        return 0
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Результаты записаны в {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
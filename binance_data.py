@@ -1,18 +1,27 @@
-import requests
 import logging
+import numpy as np
+from candle_array import from_columns
+from http_client import get_http_client
+from metrics import provider_call, PROVIDER_ERRORS
+from rate_limiter import limited, note_response, RateLimited
 
 BINANCE_ENDPOINTS = [
     "https://api.binance.com",
     "https://data-api.binance.vision"
 ]
 
+# Максимум свечей за один запрос /api/v3/klines
+MAX_KLINES_PER_REQUEST = 1000
+
 # Добавляем реалистичный User-Agent
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/129.0.0.0 Safari/537.36"
 }
 
-def get_candles(symbol, interval="1m", limit=70):
+async def get_candles(symbol, interval="1m", limit=70, start_time=None):
+    """start_time (UTC секунды) — загрузить бары начиная с этого времени (пагинация истории)."""
     symbol = symbol.replace("USD", "USDT")  # На всякий случай, хотя вызывающий код уже может это делать
+    client = get_http_client("binance", timeout=8.0, headers=HEADERS)
 
     for base_url in BINANCE_ENDPOINTS:
         url = f"{base_url}/api/v3/klines"
@@ -21,25 +30,28 @@ def get_candles(symbol, interval="1m", limit=70):
             "interval": interval,
             "limit": limit
         }
+        if start_time is not None:
+            params["startTime"] = int(start_time) * 1000
         try:
-            r = requests.get(url, params=params, timeout=8, headers=HEADERS)
+            async with limited("binance"):
+                with provider_call("binance"):
+                    r = await client.get(url, params=params)
+            note_response("binance", r.status_code, r.headers)
             if r.status_code == 200:
                 data = r.json()
                 if not data:  # Пустой ответ
                     continue
-                candles = [
-                    {
-                        "open": float(c[1]),
-                        "high": float(c[2]),
-                        "low": float(c[3]),
-                        "close": float(c[4]),
-                        "volume": float(c[5])
-                    }
-                    for c in data
-                ]
-                return candles
+                # [open_time, open, high, low, close, volume, ...] -> колонки
+                raw = np.array([c[:6] for c in data], dtype=float)
+                return from_columns(
+                    open=raw[:, 1], high=raw[:, 2], low=raw[:, 3], close=raw[:, 4], volume=raw[:, 5],
+                    time=raw[:, 0].astype(np.int64) // 1000,  # время открытия бара, UTC секунды
+                )
             else:
+                PROVIDER_ERRORS.inc(provider="binance")
                 logging.error(f"Binance {r.status_code} {r.text} via {base_url}")
+        except RateLimited:
+            raise  # квота общая для всех адресов — следующий ждал бы столько же
         except Exception as e:
             logging.error(f"Binance error via {base_url}: {e}")
 
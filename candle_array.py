@@ -0,0 +1,60 @@
+# candle_array.py
+import numpy as np
+
+# Свечи передаются по всему конвейеру одним структурированным массивом:
+# candles["close"] — колонка без копирования, candles[-1]["close"] — значение бара.
+CANDLE_DTYPE = np.dtype([
+    ("time", "<i8"),    # время открытия бара, UTC секунды (0 — неизвестно, напр. скриншот)
+    ("open", "<f8"),
+    ("high", "<f8"),
+    ("low", "<f8"),
+    ("close", "<f8"),
+    ("volume", "<f8"),
+])
+
+def empty(n: int = 0) -> np.ndarray:
+    return np.zeros(n, dtype=CANDLE_DTYPE)
+
+def from_columns(open, high, low, close, volume=None, time=None) -> np.ndarray:
+    out = empty(len(close))
+    out["open"], out["high"], out["low"], out["close"] = open, high, low, close
+    if volume is not None:
+        out["volume"] = volume
+    if time is not None:
+        out["time"] = time
+    return out
+
+def as_candles(candles) -> np.ndarray:
+    """Массив CANDLE_DTYPE как есть; список словарей (старый формат) — конвертируется."""
+    if isinstance(candles, np.ndarray) and candles.dtype == CANDLE_DTYPE:
+        return candles
+    out = empty(len(candles))
+    for name in CANDLE_DTYPE.names:
+        out[name] = [c.get(name, 0) for c in candles]
+    return out
+
+def has_time(candles) -> bool:
+    return len(candles) > 0 and int(candles["time"][-1]) > 0
+
+def resample(candles, step: int) -> np.ndarray:
+    """
+    Агрегация в бары по step секунд, выровненные по UTC-эпохе (как bar_cache.next_bar_close):
+    open — первый, high — максимум, low — минимум, close — последний, volume — сумма.
+    Неполный первый бар (история началась внутри него) отбрасывается,
+    последний — формирующийся, как и у провайдеров, — остаётся.
+    """
+    candles = as_candles(candles)
+    if len(candles) == 0:
+        return empty()
+    t = candles["time"]
+    bucket = t - t % step
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    ends = np.r_[starts[1:], len(candles)] - 1
+    out = empty(len(starts))
+    out["time"] = bucket[starts]
+    out["open"] = candles["open"][starts]
+    out["high"] = np.maximum.reduceat(candles["high"], starts)
+    out["low"] = np.minimum.reduceat(candles["low"], starts)
+    out["close"] = candles["close"][ends]
+    out["volume"] = np.add.reduceat(candles["volume"], starts)
+    return out[1:] if t[0] != bucket[0] else out
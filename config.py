@@ -10,4 +10,77 @@ logging.basicConfig(
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 TWELVE_DATA_API_KEY = os.getenv("TWELVE_DATA_API_KEY")  # Новый
+XAI_API_KEY = os.getenv("XAI_API_KEY")
+GROK_MODEL = os.getenv("GROK_MODEL", "grok-4")
+GROK_TIMEOUT_SECONDS = float(os.getenv("GROK_TIMEOUT_SECONDS", "15"))
+GROK_CACHE_TTL_SECONDS = float(os.getenv("GROK_CACHE_TTL_SECONDS", "120"))
+# Анализ, для которого Grok не ответил, кэшируется только на это время, а не до закрытия бара
+GROK_FAILURE_CACHE_SECONDS = float(os.getenv("GROK_FAILURE_CACHE_SECONDS", "10"))
 STATE_TTL_SECONDS = 15 * 60
+# Состояние пользователей: шарды блокировок, период фоновой очистки, общий бюджет памяти;
+# значения крупнее STATE_LARGE_VALUE_BYTES вытесняются первыми
+STATE_SHARDS = int(os.getenv("STATE_SHARDS", "16"))
+STATE_SWEEP_SECONDS = float(os.getenv("STATE_SWEEP_SECONDS", "60"))
+STATE_MAX_BYTES = int(os.getenv("STATE_MAX_BYTES", str(64 * 1024 * 1024)))
+STATE_LARGE_VALUE_BYTES = int(os.getenv("STATE_LARGE_VALUE_BYTES", str(64 * 1024)))
+SCAN_TOP = int(os.getenv("SCAN_TOP", "5"))  # сколько сетапов показывать в режиме сканирования
+
+# HTTP-клиенты провайдеров (отдельный пул соединений на каждый хост)
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "20"))
+HTTP_KEEPALIVE_SECONDS = float(os.getenv("HTTP_KEEPALIVE_SECONDS", "60"))
+
+# Лимиты внешних API: (запросов в минуту, допустимый всплеск). Интерактивные запросы
+# обслуживаются первыми и ждут слота не дольше RATE_LIMIT_MAX_WAIT_SECONDS, фоновые — сколько нужно
+RATE_LIMITS = {
+    "twelve_data": (float(os.getenv("TWELVE_DATA_RATE_PER_MINUTE", "8")), int(os.getenv("TWELVE_DATA_BURST", "8"))),
+    "binance": (float(os.getenv("BINANCE_RATE_PER_MINUTE", "1200")), int(os.getenv("BINANCE_BURST", "50"))),
+    "xai": (float(os.getenv("XAI_RATE_PER_MINUTE", "60")), int(os.getenv("XAI_BURST", "10"))),
+}
+RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv("RATE_LIMIT_MAX_WAIT_SECONDS", "15"))
+
+# Пулы для CPU-стадий анализа (OpenCV / признаки / модель)
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", str(min(8, os.cpu_count() or 1))))
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "0"))  # 0 — пул процессов отключён
+STAGE_QUEUE_LIMIT = int(os.getenv("STAGE_QUEUE_LIMIT", "32"))  # максимум задач в очереди на стадию
+# Стадии, которые выполняются в пуле процессов (если он включён), через запятую: "features"
+PROCESS_STAGES = {s.strip() for s in os.getenv("PROCESS_STAGES", "features").split(",") if s.strip()}
+STAGE_TIMEOUTS = {
+    "extract": float(os.getenv("STAGE_TIMEOUT_EXTRACT", "20")),
+    "features": float(os.getenv("STAGE_TIMEOUT_FEATURES", "10")),
+    "predict": float(os.getenv("STAGE_TIMEOUT_PREDICT", "10")),
+}
+
+# Инференс модели: "flat" — лес развёрнут в массивы NumPy (forest.py), "sklearn" — как есть
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "flat")
+# Пакеты больше этого числа строк идут в многопоточный sklearn (плоский обход выгоден на малых)
+FLAT_FOREST_MAX_ROWS = int(os.getenv("FLAT_FOREST_MAX_ROWS", "256"))
+# Как часто проверять models/ на новые версии файлов (0 — не проверять)
+MODEL_RELOAD_CHECK_SECONDS = float(os.getenv("MODEL_RELOAD_CHECK_SECONDS", "30"))
+
+# Скриншоты: крупные изображения уменьшаются при декодировании (в 2/4/8 раз),
+# пока длинная сторона не меньше EXTRACT_MIN_SIDE; результаты кэшируются по хэшу содержимого
+EXTRACT_MIN_SIDE = int(os.getenv("EXTRACT_MIN_SIDE", "900"))
+# Сильнее 2x однопиксельные тени свечей пропадают
+EXTRACT_MAX_REDUCTION = int(os.getenv("EXTRACT_MAX_REDUCTION", "2"))
+EXTRACT_CACHE_SIZE = int(os.getenv("EXTRACT_CACHE_SIZE", "256"))
+# Скриншоты больше этого не скачиваются (байты) и не декодируются (пиксели по заголовку)
+SCREENSHOT_MAX_BYTES = int(os.getenv("SCREENSHOT_MAX_BYTES", str(10 * 1024 * 1024)))
+SCREENSHOT_MAX_PIXELS = int(os.getenv("SCREENSHOT_MAX_PIXELS", str(40_000_000)))
+
+# Свечи: таймфреймы, кратные BASE_INTERVAL, собираются локально из одной истории на символ
+# глубиной BASE_LIMIT баров (1000 — максимум Binance за запрос, хватает на 70 баров 10m)
+BASE_INTERVAL = os.getenv("BASE_INTERVAL", "1m")
+BASE_LIMIT = int(os.getenv("BASE_LIMIT", "1000"))
+# Крипта: свечи BASE_INTERVAL из WebSocket Binance в памяти; если поток молчит дольше
+# KLINE_STREAM_STALE_SECONDS, свечи снова запрашиваются через REST
+KLINE_STREAM_ENABLED = os.getenv("KLINE_STREAM_ENABLED", "1") == "1"
+BINANCE_WS_URL = os.getenv("BINANCE_WS_URL", "wss://stream.binance.com:9443")
+KLINE_STREAM_STALE_SECONDS = float(os.getenv("KLINE_STREAM_STALE_SECONDS", "30"))
+
+# Локальное хранилище истории свечей для обучения (по файлу на символ и интервал)
+KLINE_STORE_DIR = os.getenv("KLINE_STORE_DIR", "data/klines")
+DOWNLOAD_CONCURRENCY = int(os.getenv("DOWNLOAD_CONCURRENCY", "4"))
+DOWNLOAD_REQUESTS_PER_SECOND = float(os.getenv("DOWNLOAD_REQUESTS_PER_SECOND", "5"))
+
+# Обучение: всего ядер на все уровни параллелизма (признаки, перебор параметров, деревья)
+TRAIN_CPU_BUDGET = int(os.getenv("TRAIN_CPU_BUDGET", str(os.cpu_count() or 1)))
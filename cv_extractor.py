@@ -1,50 +1,154 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
 import cv2
 import numpy as np
+from candle_array import from_columns
+from config import EXTRACT_MIN_SIDE, EXTRACT_MAX_REDUCTION, EXTRACT_CACHE_SIZE, SCREENSHOT_MAX_PIXELS
+from metrics import register_cache
+
+_REDUCED = {2: cv2.IMREAD_REDUCED_GRAYSCALE_2, 4: cv2.IMREAD_REDUCED_GRAYSCALE_4, 8: cv2.IMREAD_REDUCED_GRAYSCALE_8}
+
+class _ResultCache:
+    """LRU результатов по хэшу содержимого: тот же скриншот на другом таймфрейме не разбирается заново."""
+
+    def __init__(self, name: str, max_size: int):
+        self.name = name
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses, "coalesced": 0}
+
+extract_cache = register_cache(_ResultCache("screenshots", EXTRACT_CACHE_SIZE))
 
-def compute_quality(crop, num_candles):
+def image_size(data):
+    """(width, height) из заголовка PNG/JPEG без декодирования; None для прочих форматов."""
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and len(data) >= 24:
+        return int.from_bytes(data[16:20], "big"), int.from_bytes(data[20:24], "big")
+    if data[:2] == b"\xff\xd8":
+        i = 2
+        while i + 9 < len(data):
+            if data[i] != 0xFF:
+                i += 1
+                continue
+            marker = data[i + 1]
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):  # SOFn
+                return int.from_bytes(data[i + 7:i + 9], "big"), int.from_bytes(data[i + 5:i + 7], "big")
+            if marker == 0xD8 or marker == 0x01 or 0xD0 <= marker <= 0xD7 or marker == 0xFF:
+                i += 2 if marker != 0xFF else 1
+                continue
+            i += 2 + int.from_bytes(data[i + 2:i + 4], "big")
+    return None
+
+def reduction_factor(long_side, min_side=EXTRACT_MIN_SIDE, max_factor=EXTRACT_MAX_REDUCTION):
+    """Наибольшее уменьшение из 8/4/2 (не больше max_factor), при котором длинная сторона не меньше min_side."""
+    for factor in (8, 4, 2):
+        if factor <= max_factor and long_side // factor >= min_side:
+            return factor
+    return 1
+
+def decode(image_bytes):
+    """Серое изображение, уменьшенное ещё при декодировании, если оно крупное. -> (img, factor)"""
+    buf = np.frombuffer(image_bytes, np.uint8)
+    size = image_size(image_bytes)
+    if size and size[0] * size[1] > SCREENSHOT_MAX_PIXELS:
+        raise ValueError(f"Слишком большое изображение: {size[0]}x{size[1]}")
+    factor = reduction_factor(max(size)) if size else 1
+    img = cv2.imdecode(buf, _REDUCED[factor] if factor > 1 else cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        raise ValueError("Не удалось декодировать изображение")
+    if size is None:
+        factor = reduction_factor(max(img.shape))
+        if factor > 1:
+            img = cv2.resize(img, (img.shape[1] // factor, img.shape[0] // factor), interpolation=cv2.INTER_AREA)
+    return img, factor
+
+def compute_quality(crop, num_candles, edges=None):
     base_from_candles = min(num_candles / 50.0, 1.0)
-    edges = cv2.Canny(crop, 30, 100)
+    if edges is None:
+        edges = cv2.Canny(crop, 30, 100)
     edge_density = edges.mean() / 255.0
     contrast = crop.std() / 255.0
     technical = (edge_density + contrast) / 2
     return round(0.6 * base_from_candles + 0.4 * technical, 2)
 
-def dynamic_crop(img):
-    edges = cv2.Canny(img, 30, 100)
+def dynamic_crop(img, edges=None, margin=40):
+    """Границы области свечей (top, bottom, left, right) по проекции карты краёв."""
+    if edges is None:
+        edges = cv2.Canny(img, 30, 100)
+    h, w = img.shape
     projection = np.sum(edges, axis=1)
     threshold = np.max(projection) * 0.03 if np.max(projection) > 0 else 0
     non_zero_rows = np.where(projection > threshold)[0]
     if len(non_zero_rows) == 0:
-        return img
-    top = max(0, non_zero_rows[0] - 40)
-    bottom = min(img.shape[0], non_zero_rows[-1] + 40)
-    w = img.shape[1]
-    return img[top:bottom, int(w*0.02):int(w*0.98)]
+        return 0, h, 0, w
+    top = max(0, non_zero_rows[0] - margin)
+    bottom = min(h, non_zero_rows[-1] + margin)
+    return top, bottom, int(w*0.02), int(w*0.98)
 
 def extract_candles(image_bytes, max_candles=60):
-    img = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_GRAYSCALE)
-    if img is None:
-        raise ValueError("Не удалось декодировать изображение")
+    key = (hashlib.blake2b(image_bytes, digest_size=16).digest(), max_candles)
+    cached = extract_cache.get(key)
+    if cached is None:
+        cached = _extract(image_bytes, max_candles)
+        extract_cache.put(key, cached)
+    candles, quality = cached
+    return candles.copy(), quality
+
+def _extract(image_bytes, max_candles):
+    img, factor = decode(image_bytes)
     h, w = img.shape
+    scale = 1.0 / factor  # пиксельные константы подобраны для полного разрешения
 
     # Удаляем очевидные панели
     initial_crop = img[int(h*0.08):int(h*0.92), int(w*0.02):int(w*0.98)]
 
     # Сильное улучшение контраста
-    blurred = cv2.GaussianBlur(initial_crop, (5, 5), 0)
+    # (5, 5) на полном разрешении — это sigma 1.1; на уменьшенном размытие сужается пропорционально,
+    # иначе соседние свечи сливаются
+    blurred = cv2.GaussianBlur(initial_crop, (5, 5), 0) if factor == 1 else cv2.GaussianBlur(initial_crop, (3, 3), 1.1 * scale)
     clahe = cv2.createCLAHE(clipLimit=4.0, tileGridSize=(8,8))  # Увеличен clipLimit
     enhanced = clahe.apply(blurred)
 
-    # Динамический кроп вокруг свечей
-    crop = dynamic_crop(enhanced)
+    # Одна карта краёв на кроп, контуры и оценку качества
+    all_edges = cv2.Canny(enhanced, 30, 100)
 
-    # Более чувствительная детекция краёв
-    edges = cv2.Canny(crop, 30, 100)
+    # Динамический кроп вокруг свечей — дальше работаем только внутри него
+    top, bottom, left, right = dynamic_crop(enhanced, all_edges, margin=int(40 * scale + 0.5))
+    crop = enhanced[top:bottom, left:right]
+    edges = all_edges[top:bottom, left:right]
 
-    # Вертикальный kernel для тонких и высоких свечей
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (2, 25))
-    verticals = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, kernel, iterations=2)
-    verticals = cv2.dilate(verticals, kernel, iterations=2)
+    # Вертикальный kernel для тонких и высоких свечей. Две итерации прямоугольным ядром
+    # равны одной ядром вдвое длиннее: (2, 25) x2 -> (3, 49)
+    kw, kh = max(1, int(2 * scale + 0.5)), max(2, int(25 * scale + 0.5))
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (2 * kw - 1, 2 * kh - 1))
+    verticals = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, kernel)
+    verticals = cv2.dilate(verticals, kernel)
 
     contours, _ = cv2.findContours(verticals, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     ch, cw = crop.shape
@@ -56,17 +160,18 @@ def extract_candles(image_bytes, max_candles=60):
         if h_ < ch * 0.04: continue  # слишком короткие
         if w_ > cw * 0.12: continue   # слишком широкие (горизонтальные линии/шум)
         if h_ / max(w_, 1) < 2.0: continue  # слишком жирные
-        raw_candles.append({
-            "x": x,
-            "open": (y + h_ * 0.25) / ch,
-            "close": (y + h_ * 0.75) / ch,
-            "high": y / ch,
-            "low": (y + h_) / ch,
-        })
+        raw_candles.append((x, y, h_))
 
     # Критично: сортировка слева направо!
-    raw_candles.sort(key=lambda c: c["x"])
-    candles = [{k: v for k, v in c.items() if k != "x"} for c in raw_candles]
+    raw_candles.sort(key=lambda c: c[0])
+    raw = np.array(raw_candles, dtype=float).reshape(-1, 3)
+    y, h_ = raw[:, 1], raw[:, 2]
+    candles = from_columns(
+        open=(y + h_ * 0.25) / ch,
+        high=y / ch,
+        low=(y + h_) / ch,
+        close=(y + h_ * 0.75) / ch,
+    )
 
-    quality = compute_quality(crop, len(candles))
+    quality = compute_quality(crop, len(candles), edges)
     return candles[-max_candles:], quality
@@ -1,12 +1,54 @@
 # data_provider.py
 from binance_data import get_candles as get_candles_binance
 from twelve_data import get_client
+from bar_cache import SingleFlightCache, interval_seconds, next_bar_close
+from candle_array import resample
+from config import BASE_INTERVAL, BASE_LIMIT
+from kline_stream import stream_candles
+from metrics import register_cache
+from rate_limiter import RateLimited
 import logging
 
-def get_candles(symbol: str, interval: str = "1m", limit: int = 70):
+# Общий кэш свечей: запись живёт до закрытия текущего бара
+candle_cache = register_cache(SingleFlightCache("candles"))
+
+async def get_candles(symbol: str, interval: str = "1m", limit: int = 70):
     """
     Универсальная функция получения свечей.
+    Таймфреймы, кратные BASE_INTERVAL, собираются локально из одной базовой истории
+    symbol (BASE_LIMIT баров): один запрос к провайдеру на символ для всех таймфреймов,
+    бары всех таймфреймов согласованы и выровнены по UTC-эпохе. Для крипты из потока
+    Binance (kline_stream) базовая история берётся из памяти без сетевых запросов.
+    Остальные интервалы запрашиваются у провайдера как есть.
+    """
+    step = interval_seconds(interval)
+    base_step = interval_seconds(BASE_INTERVAL)
+    factor = step // base_step
+    if step % base_step == 0 and factor * (limit + 1) <= BASE_LIMIT:
+        base = stream_candles(symbol, BASE_INTERVAL, BASE_LIMIT)
+        if base is None:
+            base = await _cached_candles(symbol, BASE_INTERVAL, BASE_LIMIT)
+        candles = base if factor == 1 else resample(base, step)
+        return candles[-limit:]
+    return await _cached_candles(symbol, interval, limit)
+
+async def _cached_candles(symbol: str, interval: str, limit: int):
+    """
+    Ответы кэшируются по (symbol, interval, limit) до закрытия текущего бара,
+    одновременные запросы одного ключа идут в сеть один раз.
+    """
+    key = (symbol.upper(), interval, limit)
+    return await candle_cache.get_or_load(
+        key,
+        lambda: _fetch_candles(symbol, interval, limit),
+        expires_at=next_bar_close(interval),
+    )
+
+async def _fetch_candles(symbol: str, interval: str, limit: int):
+    """
     Сначала Twelve Data (с правильным форматом интервала), потом Binance.
+    Исчерпанная квота Binance сразу завершает попытки; если данных нет и квота Twelve Data
+    исчерпана, наружу уходит RateLimited.
     """
     original_symbol = symbol.upper()
     binance_symbol = original_symbol.replace("USD", "USDT")
@@ -26,17 +68,22 @@ def get_candles(symbol: str, interval: str = "1m", limit: int = 70):
     # Маппинг интервалов для Twelve Data
     td_interval_map = {
         "1m": "1min",
-        "2m": "1min",   # 2min не поддерживается → fallback на 1min
         "5m": "5min",
-        "10m": "5min",  # 10min не поддерживается → fallback на 5min
+        "15m": "15min",
+        "30m": "30min",
     }
     td_interval = td_interval_map.get(interval, interval)  # для остальных (1h и т.д.) оставляем как есть
 
+    rate_limited = None
     client = get_client()
     if client:
         logging.info(f"Пытаемся получить {forex_symbol} {td_interval} через Twelve Data...")
-        candles = client.get_candles(symbol=forex_symbol, interval=td_interval, outputsize=limit)
-        if candles:
+        try:
+            candles = await client.get_candles(symbol=forex_symbol, interval=td_interval, outputsize=limit)
+        except RateLimited as e:
+            rate_limited, candles = e, None
+            logging.warning(f"Twelve Data: {e}")
+        if candles is not None and len(candles):
             logging.info(f"Успешно получены данные через Twelve Data ({len(candles)} свечей)")
             return candles
 
@@ -46,21 +93,27 @@ def get_candles(symbol: str, interval: str = "1m", limit: int = 70):
     if not is_forex_like or original_symbol.endswith("USD"):
         logging.info(f"Пытаемся получить {binance_symbol} {interval} через Binance...")
         try:
-            candles = get_candles_binance(binance_symbol, interval=interval, limit=limit)
-            if candles:
+            candles = await get_candles_binance(binance_symbol, interval=interval, limit=limit)
+            if len(candles):
                 logging.info(f"Успешно получены данные через Binance ({len(candles)} свечей)")
                 return candles
+        except RateLimited:
+            raise  # оригинальный символ упрётся в ту же квоту
         except Exception as e:
             logging.error(f"Binance не сработал для {binance_symbol}: {e}")
 
         # Последняя попытка — оригинальный символ в Binance (для редких случаев)
         logging.info(f"Пытаемся получить {original_symbol} {interval} через Binance (оригинальный символ)...")
         try:
-            candles = get_candles_binance(original_symbol, interval=interval, limit=limit)
-            if candles:
+            candles = await get_candles_binance(original_symbol, interval=interval, limit=limit)
+            if len(candles):
                 logging.info(f"Успешно получены данные через Binance с оригинальным символом ({len(candles)} свечей)")
                 return candles
+        except RateLimited:
+            raise
         except Exception as e:
             logging.error(f"Binance не сработал и для оригинального символа {original_symbol}: {e}")
 
+    if rate_limited is not None:
+        raise rate_limited
     raise RuntimeError("Не удалось получить данные ни с Twelve Data, ни с Binance")
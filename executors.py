@@ -0,0 +1,57 @@
+# executors.py
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from metrics import register_collector
+from config import WORKER_THREADS, WORKER_PROCESSES, STAGE_QUEUE_LIMIT, PROCESS_STAGES, STAGE_TIMEOUTS
+
+class StageError(RuntimeError):
+    """Стадия не выполнена: очередь переполнена или истёк таймаут."""
+
+_thread_pool = None
+_process_pool = None
+_pending = {}  # stage -> число задач в работе и в очереди
+
+def in_process(stage: str) -> bool:
+    """Стадия уходит в пул процессов: аргументы передаются через pickle."""
+    return WORKER_PROCESSES > 0 and stage in PROCESS_STAGES
+
+def _get_pool(stage: str):
+    global _thread_pool, _process_pool
+    if in_process(stage):
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=WORKER_PROCESSES)
+        return _process_pool
+    # OpenCV и sklearn отпускают GIL — для них достаточно потоков
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix="stage")
+    return _thread_pool
+
+async def run_stage(stage: str, fn, *args, **kwargs):
+    """Выполнить fn(*args) вне event loop с ограничением очереди и таймаутом стадии."""
+    if _pending.get(stage, 0) >= STAGE_QUEUE_LIMIT:
+        raise StageError(f"Сервер перегружен ({stage}), попробуйте позже")
+
+    _pending[stage] = _pending.get(stage, 0) + 1
+    try:
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(_get_pool(stage), functools.partial(fn, *args, **kwargs))
+        return await asyncio.wait_for(future, timeout=STAGE_TIMEOUTS.get(stage))
+    except asyncio.TimeoutError:
+        logging.error(f"Стадия {stage} превысила таймаут {STAGE_TIMEOUTS.get(stage)} с")
+        raise StageError(f"Превышено время обработки ({stage})")
+    finally:
+        _pending[stage] -= 1
+
+def shutdown():
+    global _thread_pool, _process_pool
+    for pool in (_thread_pool, _process_pool):
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+    _thread_pool = _process_pool = None
+
+@register_collector
+def _queue_metrics():
+    return [("bot_stage_queue", "Задач стадии в работе и в очереди", "gauge",
+             [({"stage": stage}, n) for stage, n in sorted(_pending.items())])]
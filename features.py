@@ -1,43 +1,29 @@
 import numpy as np
-from indicators import (compute_rsi, compute_macd, compute_bollinger, compute_ema, 
-                        compute_stochastic, compute_adx_strength, compute_atr, 
-                        compute_cci, compute_parabolic_sar)  # Импорт всех
+from candle_array import as_candles
+from indicators import compute_indicator_series
 
-def build_features(candles, tf):
+def build_features(candles, tf, ind=None):
+    """ind — готовые ряды compute_indicator_series (бэктест подставляет в них оконные EMA и SAR)."""
     if len(candles) < 2:
         return np.array([])
 
-    closes = np.array([c["close"] for c in candles])
-    highs = np.array([c["high"] for c in candles])
-    lows = np.array([c["low"] for c in candles])
+    candles = as_candles(candles)
+    opens, closes, highs, lows = candles["open"], candles["close"], candles["high"], candles["low"]
 
-    indicators = {
-        "rsi": compute_rsi(closes),
-        "macd": compute_macd(closes),
-        "bb": 1 if compute_bollinger(closes) == "overbought" else -1 if compute_bollinger(closes) == "oversold" else 0,  # Кодируем
-        "ema": compute_ema(closes),
-        "stoch": compute_stochastic(closes, highs, lows),
-        "adx": compute_adx_strength(highs, lows, closes),
-        "atr": compute_atr(highs, lows, closes),
-        "cci": compute_cci(highs, lows, closes),
-        "psar": 1 if compute_parabolic_sar(highs, lows, closes) == "up" else -1 if "down" else 0
-    }
+    # Индикаторы считаются для каждого бара (значение на момент закрытия этого бара)
+    if ind is None:
+        ind = compute_indicator_series(closes, highs, lows)
 
-    X = []
     scale = {"1": 1.0, "2": 1.2, "5": 1.5, "10": 2.0}.get(tf, 1.0)
-    
-    for i in range(1, len(candles)):
-        c = candles[i]
-        body = abs(c["close"] - c["open"]) * scale
-        direction = np.sign(c["close"] - c["open"])
-        vol = (c["high"] - c["low"]) * scale
-        
-        # Добавляем индикаторы как фичи (нормализуем где нужно)
-        feat = [body, direction, vol, 
-                indicators["rsi"]/100, indicators["macd"], indicators["bb"], 
-                (c["close"] - indicators["ema"]) / indicators["ema"],  # Relative to EMA
-                indicators["stoch"]/100, indicators["adx"]/100, indicators["atr"],
-                indicators["cci"]/200, indicators["psar"]]  # Нормализация CCI (-200 to 200 -> -1 to 1)
-        X.append(feat)
-    
-    return np.array(X) if X else np.array([])
+
+    X = np.column_stack([
+        np.abs(closes - opens) * scale,   # body
+        np.sign(closes - opens),          # direction
+        (highs - lows) * scale,           # vol
+        ind["rsi"] / 100, ind["macd"], ind["bb"],
+        (closes - ind["ema"]) / ind["ema"],  # Relative to EMA
+        ind["stoch"] / 100, ind["adx"] / 100, ind["atr"],
+        ind["cci"] / 200, ind["psar"],       # Нормализация CCI (-200 to 200 -> -1 to 1)
+    ])
+
+    return X[1:]
@@ -0,0 +1,79 @@
+# forest.py
+import numpy as np
+
+class FlatForest:
+    """
+    Обученный sklearn-лес (RandomForestClassifier / ExtraTreesClassifier), развёрнутый
+    в плоские массивы узлов всех деревьев. predict_proba обходит все деревья сразу
+    векторно, без валидации входа, joblib и цикла по деревьям в Python.
+    """
+
+    def __init__(self, feature, threshold, left, right, missing_left, value, roots, depth, classes):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.missing_left = missing_left
+        self.value = value
+        self.roots = roots
+        self.depth = depth
+        self.classes_ = classes
+        self.n_features_in_ = None
+
+    @classmethod
+    def from_sklearn(cls, model):
+        if getattr(model, "n_outputs_", 1) != 1:
+            raise ValueError("Поддерживаются только леса с одним выходом")
+        features, thresholds, lefts, rights, missing, values, roots = [], [], [], [], [], [], []
+        offset, depth = 0, 0
+        for est in model.estimators_:
+            t = est.tree_
+            n = t.node_count
+            leaf = t.children_left == -1
+            nodes = np.arange(offset, offset + n)
+            # Лист ссылается сам на себя — обход фиксированной глубины на нём останавливается
+            lefts.append(np.where(leaf, nodes, t.children_left + offset))
+            rights.append(np.where(leaf, nodes, t.children_right + offset))
+            features.append(np.where(leaf, 0, t.feature))
+            thresholds.append(t.threshold)
+            missing.append(getattr(t, "missing_go_to_left", np.zeros(n, dtype=np.uint8)).astype(bool))
+            value = t.value[:, 0, :].astype(float)
+            values.append(value / value.sum(axis=1, keepdims=True))  # доли классов, как tree.predict_proba
+            roots.append(offset)
+            offset += n
+            depth = max(depth, t.max_depth)
+        forest = cls(
+            feature=np.concatenate(features).astype(np.intp),
+            threshold=np.concatenate(thresholds),
+            left=np.concatenate(lefts).astype(np.intp),
+            right=np.concatenate(rights).astype(np.intp),
+            missing_left=np.concatenate(missing),
+            value=np.concatenate(values),
+            roots=np.asarray(roots, dtype=np.intp),
+            depth=depth,
+            classes=np.asarray(model.classes_),
+        )
+        forest.n_features_in_ = getattr(model, "n_features_in_", None)
+        return forest
+
+    def apply(self, X):
+        """Индексы листьев, формы (строки, деревья)."""
+        # sklearn сравнивает признаки в float32 — иначе пороги на границе дают другие ветви
+        X = np.asarray(X, dtype=np.float32).astype(float)
+        flat_X = X.ravel()
+        row_start = (np.arange(len(X)) * X.shape[1])[:, None]
+        node = np.broadcast_to(self.roots, (len(X), len(self.roots)))
+        for _ in range(self.depth):
+            x = flat_X[row_start + self.feature[node]]
+            go_left = (x <= self.threshold[node]) | (np.isnan(x) & self.missing_left[node])
+            node = np.where(go_left, self.left[node], self.right[node])
+        return node
+
+    def predict_proba(self, X):
+        X = np.asarray(X)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        return self.value[self.apply(X)].mean(axis=1)
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
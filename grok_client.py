@@ -0,0 +1,52 @@
+# grok_client.py
+import hashlib
+import logging
+import time
+
+from bar_cache import SingleFlightCache
+from config import XAI_API_KEY, GROK_MODEL, GROK_TIMEOUT_SECONDS, GROK_CACHE_TTL_SECONDS
+from http_client import get_http_client
+from metrics import register_cache, provider_call
+from rate_limiter import limited, note_response
+
+XAI_URL = "https://api.x.ai/v1/chat/completions"
+
+# Ответы Grok по (symbol, tf, время последнего бара, хэш промпта)
+grok_cache = register_cache(SingleFlightCache("grok"))
+
+def grok_enabled() -> bool:
+    return bool(XAI_API_KEY)
+
+async def _request(prompt: str) -> float:
+    # Время и ошибки запросов — в bot_provider_request_seconds / bot_provider_errors_total{provider="xai"}
+    async with limited("xai"):
+        with provider_call("xai"):
+            resp = await get_http_client("xai", timeout=GROK_TIMEOUT_SECONDS).post(
+                XAI_URL,
+                headers={"Authorization": f"Bearer {XAI_API_KEY}", "Content-Type": "application/json"},
+                json={
+                    "model": GROK_MODEL,
+                    "messages": [{"role": "user", "content": prompt}],
+                    "temperature": 0.2,
+                    "max_tokens": 8
+                }
+            )
+            note_response("xai", resp.status_code, resp.headers)
+            if resp.status_code != 200:
+                raise RuntimeError(f"Grok error {resp.status_code}: {resp.text}")
+    txt = resp.json()["choices"][0]["message"]["content"].strip()
+    return float(txt) if txt.replace(".", "").isdigit() else 0.5
+
+async def ask_grok(prompt: str, key: tuple = ()):
+    """
+    Вероятность роста от Grok. Успешные ответы кэшируются на GROK_CACHE_TTL_SECONDS,
+    одинаковые одновременные запросы объединяются; при ошибке (в том числе RateLimited) — None.
+    """
+    cache_key = (*key, hashlib.sha256(prompt.encode()).hexdigest())
+    try:
+        return await grok_cache.get_or_load(
+            cache_key, lambda: _request(prompt), expires_at=time.time() + GROK_CACHE_TTL_SECONDS
+        )
+    except Exception as e:
+        logging.error(f"Grok exception: {e}")
+        return None
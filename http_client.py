@@ -0,0 +1,40 @@
+# http_client.py
+import asyncio
+import importlib.util
+import logging
+import httpx
+from config import HTTP_MAX_CONNECTIONS_PER_HOST, HTTP_KEEPALIVE_SECONDS
+
+# HTTP/2 доступен только при установленном пакете h2 (httpx[http2])
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# name -> (event loop, AsyncClient); по одному долгоживущему клиенту на провайдера
+_clients = {}
+
+def get_http_client(name: str, timeout: float = 10.0, headers: dict = None) -> httpx.AsyncClient:
+    """Общий keep-alive клиент для провайдера. Пересоздаётся, если сменился event loop."""
+    loop = asyncio.get_running_loop()
+    entry = _clients.get(name)
+    if entry is not None and entry[0] is loop and not entry[1].is_closed:
+        return entry[1]
+
+    client = httpx.AsyncClient(
+        timeout=timeout,
+        headers=headers,
+        http2=HTTP2_AVAILABLE,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS_PER_HOST,
+            max_keepalive_connections=HTTP_MAX_CONNECTIONS_PER_HOST,
+            keepalive_expiry=HTTP_KEEPALIVE_SECONDS,
+        ),
+    )
+    _clients[name] = (loop, client)
+    logging.debug(f"HTTP-клиент {name} создан (http2={HTTP2_AVAILABLE})")
+    return client
+
+async def close_http_clients():
+    loop = asyncio.get_running_loop()
+    for name, (client_loop, client) in list(_clients.items()):
+        if client_loop is loop:
+            await client.aclose()
+        _clients.pop(name, None)
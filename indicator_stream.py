@@ -0,0 +1,162 @@
+# indicator_stream.py
+import copy
+import math
+from collections import deque
+
+from indicators import compute_parabolic_sar
+
+class IndicatorStream:
+    """
+    Инкрементальные индикаторы для одной пары (symbol, tf).
+    Каждая свеча обновляет состояние за O(1): окна фиксированной длины.
+    snapshot() совпадает с функциями из indicators.py, вызванными на всей принятой истории
+    (EMA — как в predictor.analyze, по последним 20 закрытиям). Parabolic SAR рекурсивен
+    с первого бара, поэтому считается по последнему окну из sync, как в predictor.analyze,
+    — иначе результат зависел бы от того, как давно запущен процесс.
+    """
+
+    def __init__(self, af_step=0.015, af_max=0.2):
+        self.af_step = af_step
+        self.af_max = af_max
+        self.reset()
+
+    def reset(self):
+        self.bars = 0
+        self.last_time = None
+        self.closes = deque(maxlen=26)   # MACD slow / Bollinger / EMA-20
+        self.highs = deque(maxlen=14)    # Stochastic
+        self.lows = deque(maxlen=14)
+        self.tp = deque(maxlen=20)       # CCI
+        self.gains = deque(maxlen=14)    # RSI
+        self.losses = deque(maxlen=14)
+        self.tr = deque(maxlen=14)       # ATR / ADX
+        self.plus_dm = deque(maxlen=14)
+        self.minus_dm = deque(maxlen=14)
+        self.prev = None                 # (high, low, close) предыдущего бара
+        self.window = None               # последнее окно из sync — для Parabolic SAR
+        self._saved = None
+
+    def _state(self):
+        return {k: copy.copy(v) for k, v in self.__dict__.items() if k not in ("_saved", "window")}
+
+    def update(self, candle):
+        """Принять закрытую свечу. Свеча с тем же time, что и последняя, заменяет её."""
+        t = int(candle["time"]) or None  # 0 — время бара неизвестно
+        if t is not None and self.last_time is not None:
+            if t < self.last_time:
+                return
+            if t == self.last_time and self._saved is not None:
+                self.__dict__.update(self._saved)
+        self._saved = self._state()
+        self._apply(float(candle["high"]), float(candle["low"]), float(candle["close"]))
+        self.last_time = t
+
+    def sync(self, candles):
+        """Догнать окно свечей от провайдера (массив CANDLE_DTYPE): принимаются только новые бары."""
+        if len(candles) == 0:
+            return self
+        first, last = int(candles["time"][0]), int(candles["time"][-1])
+        if not first or self.last_time is None or first > self.last_time or last < self.last_time:
+            # Нет перекрытия с уже принятой историей — начинаем заново
+            self.reset()
+            for c in candles:
+                self.update(c)
+        else:
+            for c in candles[candles["time"] >= self.last_time]:
+                self.update(c)
+        self.window = candles
+        return self
+
+    def _apply(self, high, low, close):
+        if self.prev is not None:
+            ph, pl, pc = self.prev
+            delta = close - pc
+            self.gains.append(delta if delta > 0 else 0.0)
+            self.losses.append(-delta if delta < 0 else 0.0)
+            self.tr.append(max(high - low, max(abs(high - pc), abs(low - pc))))
+            up_move = high - ph
+            down_move = pl - low
+            self.plus_dm.append(up_move if up_move > down_move and up_move > 0 else 0.0)
+            self.minus_dm.append(down_move if down_move > up_move and down_move > 0 else 0.0)
+
+        self.closes.append(close)
+        self.highs.append(high)
+        self.lows.append(low)
+        self.tp.append((high + low + close) / 3)
+        self.prev = (high, low, close)
+        self.bars += 1
+
+    def snapshot(self):
+        n = self.bars
+        closes = list(self.closes)
+        price = closes[-1] if closes else 0.0
+
+        avg_gain = sum(self.gains) / 14 if n - 1 >= 14 else 0.5
+        avg_loss = sum(self.losses) / 14 if n - 1 >= 14 else 0.5
+        rsi = 100 - (100 / (1 + avg_gain / (avg_loss + 1e-9)))
+
+        macd = sum(closes[-12:]) / 12 - sum(closes) / 26 if n >= 26 else 0.0
+
+        bb = "neutral"
+        if n >= 20:
+            window = closes[-20:]
+            sma = sum(window) / 20
+            std = math.sqrt(sum((p - sma) ** 2 for p in window) / 20)
+            if price > sma + 2 * std:
+                bb = "overbought"
+            elif price < sma - 2 * std:
+                bb = "oversold"
+
+        ema = 0.0
+        if closes:
+            window = closes[-20:]
+            alpha = 2 / (9 + 1)
+            ema = window[0]
+            for p in window[1:]:
+                ema = alpha * p + (1 - alpha) * ema
+
+        stoch = 50.0
+        if n >= 14:
+            low_min, high_max = min(self.lows), max(self.highs)
+            if high_max != low_min:
+                stoch = 100 * (price - low_min) / (high_max - low_min)
+
+        adx, atr = 20.0, 0.0
+        if n >= 15:
+            atr = sum(self.tr) / 14
+            plus_di = 100 * (sum(self.plus_dm) / 14) / (atr + 1e-9)
+            minus_di = 100 * (sum(self.minus_dm) / 14) / (atr + 1e-9)
+            adx = abs(plus_di - minus_di) / (plus_di + minus_di + 1e-9) * 100
+
+        cci = 0.0
+        if n >= 20:
+            sma_tp = sum(self.tp) / 20
+            mad = sum(abs(x - sma_tp) for x in self.tp) / 20
+            cci = (self.tp[-1] - sma_tp) / (0.015 * mad + 1e-9)
+
+        psar = "neutral"
+        if self.window is not None:
+            w = self.window
+            psar = compute_parabolic_sar(w["high"], w["low"], w["close"], self.af_step, self.af_max)
+
+        return {
+            "rsi": rsi,
+            "macd": macd,
+            "bb": bb,
+            "ema": ema,
+            "stoch": stoch,
+            "adx": adx,
+            "atr": atr,
+            "cci": cci,
+            "psar": psar,
+        }
+
+# Состояние по каждой паре (symbol, tf)
+_streams = {}
+
+def get_stream(symbol: str, tf: str) -> IndicatorStream:
+    key = (symbol.upper(), tf)
+    stream = _streams.get(key)
+    if stream is None:
+        stream = _streams[key] = IndicatorStream()
+    return stream
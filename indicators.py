@@ -123,6 +123,172 @@ def compute_parabolic_sar(highs, lows, closes, af_step=0.015, af_max=0.2):
         return "down"
     return "neutral"
 
+# --- Векторный движок: полные ряды индикаторов за один проход ---
+# Значение ряда в позиции i совпадает со скалярной функцией, вызванной на closes[:i+1].
+
+def _rolling_mean(x, period):
+    """Скользящее среднее по окну period через кумулятивные суммы (NaN до заполнения окна)."""
+    x = np.asarray(x, dtype=float)
+    out = np.full(len(x), np.nan)
+    if len(x) < period:
+        return out
+    offset = x[0]  # сдвиг уменьшает накопление ошибки в cumsum на больших ценах
+    c = np.concatenate(([0.0], np.cumsum(x - offset)))
+    out[period - 1:] = (c[period:] - c[:-period]) / period + offset
+    return out
+
+def _windows(x, period):
+    return np.lib.stride_tricks.sliding_window_view(np.asarray(x, dtype=float), period)
+
+def _true_range(highs, lows, closes):
+    return np.maximum(
+        highs[1:] - lows[1:],
+        np.maximum(abs(highs[1:] - closes[:-1]), abs(lows[1:] - closes[:-1]))
+    )
+
+def rsi_series(closes, period=14):
+    n = len(closes)
+    deltas = np.diff(closes)
+    gain = np.where(deltas > 0, deltas, 0)
+    loss = np.where(deltas < 0, -deltas, 0)
+    avg_gain = np.full(n, 0.5)
+    avg_loss = np.full(n, 0.5)
+    if n > period:
+        avg_gain[period:] = _rolling_mean(gain, period)[period - 1:]
+        avg_loss[period:] = _rolling_mean(loss, period)[period - 1:]
+    rs = avg_gain / (avg_loss + 1e-9)
+    return 100 - (100 / (1 + rs))
+
+def macd_series(closes, fast=12, slow=26, signal=9):
+    out = np.zeros(len(closes))
+    if len(closes) >= slow:
+        out[slow - 1:] = _rolling_mean(closes, fast)[slow - 1:] - _rolling_mean(closes, slow)[slow - 1:]
+    return out
+
+def bollinger_series(closes, period=20, std_dev=2):
+    """1 — overbought, -1 — oversold, 0 — neutral (как кодирует build_features)."""
+    out = np.zeros(len(closes), dtype=np.int8)
+    if len(closes) < period:
+        return out
+    w = _windows(closes, period)
+    sma = w.mean(axis=1)
+    std = w.std(axis=1)
+    price = np.asarray(closes, dtype=float)[period - 1:]
+    out[period - 1:] = np.where(price > sma + std_dev * std, 1, np.where(price < sma - std_dev * std, -1, 0))
+    return out
+
+def ema_series(closes, period=9):
+    out = np.zeros(len(closes))
+    if len(closes) == 0:
+        return out
+    alpha = 2 / (period + 1)
+    values = np.asarray(closes, dtype=float).tolist()
+    ema = values[0]
+    out[0] = ema
+    for i in range(1, len(values)):
+        ema = alpha * values[i] + (1 - alpha) * ema
+        out[i] = ema
+    return out
+
+def stochastic_series(closes, highs, lows, period=14):
+    out = np.full(len(closes), 50.0)
+    if len(closes) < period:
+        return out
+    low_min = _windows(lows, period).min(axis=1)
+    high_max = _windows(highs, period).max(axis=1)
+    price = np.asarray(closes, dtype=float)[period - 1:]
+    rng = high_max - low_min
+    with np.errstate(divide="ignore", invalid="ignore"):
+        stoch = np.where(rng == 0, 50.0, 100 * (price - low_min) / rng)
+    out[period - 1:] = stoch
+    return out
+
+def atr_series(highs, lows, closes, period=14):
+    out = np.zeros(len(closes))
+    if len(closes) < period + 1:
+        return out
+    out[period:] = _rolling_mean(_true_range(highs, lows, closes), period)[period - 1:]
+    return out
+
+def adx_series(highs, lows, closes, period=14):
+    out = np.full(len(closes), 20.0)
+    if len(closes) < period + 1:
+        return out
+    atr = _rolling_mean(_true_range(highs, lows, closes), period)[period - 1:]
+
+    up_move = highs[1:] - highs[:-1]
+    down_move = lows[:-1] - lows[1:]
+    plus_dm = np.where((up_move > down_move) & (up_move > 0), up_move, 0)
+    minus_dm = np.where((down_move > up_move) & (down_move > 0), down_move, 0)
+
+    plus_di = 100 * _rolling_mean(plus_dm, period)[period - 1:] / (atr + 1e-9)
+    minus_di = 100 * _rolling_mean(minus_dm, period)[period - 1:] / (atr + 1e-9)
+    out[period:] = abs(plus_di - minus_di) / (plus_di + minus_di + 1e-9) * 100
+    return out
+
+def cci_series(highs, lows, closes, period=20):
+    out = np.zeros(len(closes))
+    if len(closes) < period:
+        return out
+    tp = (np.array(highs) + np.array(lows) + np.array(closes)) / 3
+    w = _windows(tp, period)
+    sma_tp = w.mean(axis=1)
+    mad = np.mean(np.abs(w - sma_tp[:, None]), axis=1)
+    out[period - 1:] = (tp[period - 1:] - sma_tp) / (0.015 * mad + 1e-9)
+    return out
+
+def parabolic_sar_series(highs, lows, closes, af_step=0.015, af_max=0.2):
+    """1 — up, -1 — down, 0 — neutral (первый бар). Тот же цикл, что и compute_parabolic_sar."""
+    n = len(closes)
+    out = np.zeros(n, dtype=np.int8)
+    if n < 2:
+        return out
+    h = np.asarray(highs, dtype=float).tolist()
+    l = np.asarray(lows, dtype=float).tolist()
+    sar = l[0]
+    ep = h[0]
+    af = 0.015
+    trend = 1
+    for i in range(1, n):
+        sar = sar + af * (ep - sar)
+        if trend > 0:
+            if l[i] < sar:
+                trend = -1
+                sar = ep
+                ep = l[i]
+                af = 0.015
+            elif h[i] > ep:
+                ep = h[i]
+                af = min(af + af_step, af_max)
+        else:
+            if h[i] > sar:
+                trend = 1
+                sar = ep
+                ep = h[i]
+                af = 0.015
+            elif l[i] < ep:
+                ep = l[i]
+                af = min(af + af_step, af_max)
+        out[i] = trend
+    return out
+
+def compute_indicator_series(closes, highs, lows):
+    """Все индикаторы как выровненные по барам ряды длины len(closes)."""
+    closes = np.asarray(closes, dtype=float)
+    highs = np.asarray(highs, dtype=float)
+    lows = np.asarray(lows, dtype=float)
+    return {
+        "rsi": rsi_series(closes),
+        "macd": macd_series(closes),
+        "bb": bollinger_series(closes),
+        "ema": ema_series(closes),
+        "stoch": stochastic_series(closes, highs, lows),
+        "adx": adx_series(highs, lows, closes),
+        "atr": atr_series(highs, lows, closes),
+        "cci": cci_series(highs, lows, closes),
+        "psar": parabolic_sar_series(highs, lows, closes),
+    }
+
 def scalping_strategy(indicators, patterns, regime):
     adj = 0.0
     rsi = indicators['rsi']
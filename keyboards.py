@@ -47,7 +47,8 @@ def market_keyboard():
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
-def tickers_keyboard(market: str):
+def market_tickers(market: str):
+    """(тикеры рынка для текущей сессии, описание сессии)."""
     session_key, session_text = get_current_session()
     
     # Для крипты и металлов/акций — нет разделения по сессиям, берём весь список напрямую
@@ -63,7 +64,12 @@ def tickers_keyboard(market: str):
     else:
         # Для forex — выбираем по текущей сессии
         tickers = MARKET_CATEGORIES.get("forex", {}).get(session_key, [])
-    
+    return tickers, session_text
+
+
+def tickers_keyboard(market: str):
+    tickers, session_text = market_tickers(market)
+
     buttons = []
     row = []
     for t in tickers:
@@ -74,6 +80,8 @@ def tickers_keyboard(market: str):
     if row:
         buttons.append(row)
     
+    if tickers:
+        buttons.append([InlineKeyboardButton(text="🔎 Сканировать все", callback_data=f"scan:{market}")])
     buttons.append([InlineKeyboardButton(text="🔙 Назад к рынкам", callback_data="back:markets")])
     
     info = f"Текущая сессия: {session_text}\nРекомендуемые пары для {market.upper()}:\n\nВыберите тикер:"
@@ -0,0 +1,70 @@
+# kline_downloader.py
+import asyncio
+import logging
+import time
+
+import kline_store
+from bar_cache import interval_seconds
+from binance_data import get_candles as get_candles_binance, MAX_KLINES_PER_REQUEST
+from config import DOWNLOAD_CONCURRENCY, DOWNLOAD_REQUESTS_PER_SECOND
+from rate_limiter import priority, BACKGROUND
+
+class _Pacer:
+    """Не чаще rate запросов в секунду на весь загрузчик."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_at = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            now = time.monotonic()
+            if self.next_at > now:
+                await asyncio.sleep(self.next_at - now)
+            self.next_at = max(now, self.next_at) + self.interval
+
+async def sync_symbol(symbol: str, interval: str, bars: int, pacer: _Pacer = None) -> int:
+    """
+    Догрузить историю symbol/interval в хранилище: сначала глубиной bars баров,
+    при повторных запусках — только недостающий хвост. Сохраняются только закрытые бары.
+    """
+    step = interval_seconds(interval)
+    now = time.time()
+    last = kline_store.last_time(symbol, interval)
+    start = last + step if last is not None else int(now // step - bars) * step
+    written = 0
+
+    while start + step <= now:
+        if pacer is not None:
+            await pacer.wait()
+        candles = await get_candles_binance(symbol, interval=interval, limit=MAX_KLINES_PER_REQUEST, start_time=start)
+        records = candles[candles["time"] + step <= now]  # незакрытый бар не сохраняем
+        written += kline_store.append(symbol, interval, records)
+        if len(candles) < MAX_KLINES_PER_REQUEST or len(records) == 0:
+            break
+        start = int(records["time"][-1]) + step
+
+    logging.info(f"{symbol} {interval}: +{written} баров в хранилище")
+    return written
+
+async def sync_all(symbols, interval: str, bars: int) -> dict:
+    """Параллельная загрузка символов в пределах DOWNLOAD_CONCURRENCY и общего темпа запросов."""
+    results = await sync_pairs([(s, interval) for s in symbols], bars)
+    return {symbol: results[(symbol, interval)] for symbol in symbols}
+
+async def sync_pairs(pairs, bars: int) -> dict:
+    """
+    То же для пар (symbol, interval) разных интервалов: лимиты общие на все пары.
+    Запросы фоновые — в общем лимите Binance они пропускают вперёд запросы пользователей.
+    """
+    pacer = _Pacer(DOWNLOAD_REQUESTS_PER_SECOND)
+    slots = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+
+    async def one(symbol, interval):
+        async with slots:
+            return await sync_symbol(symbol, interval, bars, pacer)
+
+    with priority(BACKGROUND):
+        results = await asyncio.gather(*(one(s, i) for s, i in pairs), return_exceptions=True)
+    return dict(zip(pairs, results))
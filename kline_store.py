@@ -0,0 +1,54 @@
+# kline_store.py
+"""
+История свечей на диске: один append-only файл на (symbol, interval), читается как memmap.
+
+Раскладка построчная, а не по колонкам: запись CANDLE_DTYPE = один бар, файл — непрерывный
+массив записей без заголовка. Отдельные файлы на поле не дают выигрыша: resample, через
+который идут все чтения, использует все шесть полей, а один файл дописывается одной
+операцией и целиком соответствует массиву свечей, с которым работает остальной код.
+Колонка (load(...)["close"]) — strided-представление того же memmap, без копирования.
+"""
+import os
+import numpy as np
+from candle_array import CANDLE_DTYPE
+from config import KLINE_STORE_DIR
+
+def store_path(symbol: str, interval: str) -> str:
+    return os.path.join(KLINE_STORE_DIR, f"{symbol.upper()}_{interval}.bin")
+
+def _valid_rows(path: str) -> int:
+    """Число целых записей; хвост от прерванной записи отрезается."""
+    if not os.path.exists(path):
+        return 0
+    size = os.path.getsize(path)
+    rows, extra = divmod(size, CANDLE_DTYPE.itemsize)
+    if extra:
+        with open(path, "r+b") as f:
+            f.truncate(rows * CANDLE_DTYPE.itemsize)
+    return rows
+
+def load(symbol: str, interval: str) -> np.ndarray:
+    """Вся история как memmap (без копирования в память процесса)."""
+    path = store_path(symbol, interval)
+    rows = _valid_rows(path)
+    if rows == 0:
+        return np.zeros(0, dtype=CANDLE_DTYPE)
+    return np.memmap(path, dtype=CANDLE_DTYPE, mode="r", shape=(rows,))
+
+def last_time(symbol: str, interval: str):
+    data = load(symbol, interval)
+    return int(data["time"][-1]) if len(data) else None
+
+def append(symbol: str, interval: str, records: np.ndarray) -> int:
+    """Дописать бары новее последнего сохранённого. Возвращает число записанных."""
+    if len(records) == 0:
+        return 0
+    last = last_time(symbol, interval)
+    if last is not None:
+        records = records[records["time"] > last]
+    if len(records) == 0:
+        return 0
+    os.makedirs(KLINE_STORE_DIR, exist_ok=True)
+    with open(store_path(symbol, interval), "ab") as f:
+        f.write(np.ascontiguousarray(records, dtype=CANDLE_DTYPE).tobytes())
+    return len(records)
@@ -0,0 +1,211 @@
+# kline_stream.py
+"""
+Свечи крипты из WebSocket Binance (<symbol>@kline_<interval>) в кольцевых буферах в памяти.
+
+При каждом подключении буферы догружаются через REST (binance_data.get_candles), пропуски
+между сообщениями тоже закрываются REST-запросом, после чего data_provider отдаёт свечи
+подписанных символов из памяти без сетевых запросов. Адрес потока и функция догрузки
+задаются при создании KlineStream — его можно проверить на локальном WebSocket-сервере.
+"""
+import asyncio
+import json
+import logging
+import time
+
+import numpy as np
+
+from bar_cache import interval_seconds
+from candle_array import empty
+from config import BASE_INTERVAL, BASE_LIMIT, BINANCE_WS_URL, KLINE_STREAM_STALE_SECONDS
+from metrics import Counter, register_collector
+from rate_limiter import priority, BACKGROUND
+
+MESSAGES = Counter("bot_kline_stream_messages_total", "Сообщения потока свечей Binance")
+RECONNECTS = Counter("bot_kline_stream_reconnects_total", "Переподключения потока свечей Binance")
+BACKFILLS = Counter("bot_kline_stream_backfills_total", "Догрузки буферов через REST", ("reason",))
+SERVED = Counter("bot_kline_stream_served_total", "Запросы свечей крипты", ("result",))
+
+def stream_symbol(symbol: str) -> str:
+    """BTCUSD -> BTCUSDT, как в binance_data."""
+    return symbol.upper().replace("USD", "USDT")
+
+
+class RingBuffer:
+    """Последние capacity свечей CANDLE_DTYPE; бар с тем же time, что и последний, заменяет его."""
+
+    def __init__(self, capacity: int):
+        self.data = empty(capacity)
+        self.start = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def last_time(self):
+        if not self.size:
+            return None
+        return int(self.data["time"][(self.start + self.size - 1) % len(self.data)])
+
+    def push(self, bar):
+        """bar — кортеж (time, open, high, low, close, volume). Бары старше последнего пропускаются."""
+        last = self.last_time
+        if last is not None and bar[0] < last:
+            return
+        capacity = len(self.data)
+        if last == bar[0]:
+            self.data[(self.start + self.size - 1) % capacity] = bar
+        elif self.size < capacity:
+            self.data[(self.start + self.size) % capacity] = bar
+            self.size += 1
+        else:
+            self.data[self.start] = bar
+            self.start = (self.start + 1) % capacity
+
+    def snapshot(self, limit: int = None) -> np.ndarray:
+        """Копия последних limit свечей, от старых к новым."""
+        n = self.size if limit is None else min(limit, self.size)
+        return self.data[(self.start + self.size - n + np.arange(n)) % len(self.data)]
+
+    def load(self, candles):
+        """
+        Заменить содержимое историей из REST; бары из потока новее её последнего бара
+        (пришли, пока шёл запрос) остаются.
+        """
+        newer = self.snapshot()
+        if len(candles):
+            newer = newer[newer["time"] > candles["time"][-1]]
+        merged = np.concatenate([candles, newer])[-len(self.data):]
+        self.data[:len(merged)] = merged
+        self.start, self.size = 0, len(merged)
+
+
+class KlineStream:
+    """Подписка на свечи symbols с переподключением; backfill(symbol, interval, limit) — REST-догрузка."""
+
+    def __init__(self, symbols, interval: str = BASE_INTERVAL, capacity: int = BASE_LIMIT,
+                 url: str = BINANCE_WS_URL, backfill=None):
+        self.symbols = sorted({stream_symbol(s) for s in symbols})
+        self.interval = interval
+        self.step = interval_seconds(interval)
+        self.capacity = capacity
+        self.url = url.rstrip("/")
+        self.backfill = backfill
+        self.buffers = {s: RingBuffer(capacity) for s in self.symbols}
+        self.connected = False
+        self.last_message = 0.0
+        self._ready = set()   # символы, догруженные после последнего подключения
+        self._backfilling = {}
+
+    def stream_url(self) -> str:
+        streams = "/".join(f"{s.lower()}@kline_{self.interval}" for s in self.symbols)
+        return f"{self.url}/stream?streams={streams}"
+
+    def candles(self, symbol: str, limit: int = None):
+        """Свечи из памяти или None, если поток не подключён, молчит или буфер ещё не догружен."""
+        symbol = stream_symbol(symbol)
+        if (symbol not in self._ready or not self.connected
+                or time.monotonic() - self.last_message > KLINE_STREAM_STALE_SECONDS):
+            return None
+        return self.buffers[symbol].snapshot(limit)
+
+    async def _backfill(self, symbol: str, reason: str):
+        BACKFILLS.inc(reason=reason)
+        try:
+            with priority(BACKGROUND):
+                candles = await self.backfill(symbol, interval=self.interval, limit=self.capacity)
+            self.buffers[symbol].load(candles)
+            self._ready.add(symbol)
+        except Exception as e:
+            self._ready.discard(symbol)
+            logging.error(f"Поток свечей: не удалось догрузить {symbol}: {e}")
+        finally:
+            self._backfilling.pop(symbol, None)
+
+    def _schedule_backfill(self, symbol: str, reason: str):
+        if symbol not in self._backfilling:
+            self._backfilling[symbol] = asyncio.get_running_loop().create_task(self._backfill(symbol, reason))
+
+    def handle(self, message: dict):
+        """Сообщение комбинированного потока: {"stream": ..., "data": {"e": "kline", "k": {...}}}."""
+        k = message.get("data", message).get("k")
+        if not k:
+            return
+        symbol = k["s"]
+        buffer = self.buffers.get(symbol)
+        if buffer is None:
+            return
+        bar = (int(k["t"]) // 1000, float(k["o"]), float(k["h"]), float(k["l"]), float(k["c"]), float(k["v"]))
+        last = buffer.last_time
+        buffer.push(bar)
+        if last is not None and bar[0] > last + self.step:  # пропущены бары — догружаем через REST
+            self._ready.discard(symbol)
+            self._schedule_backfill(symbol, "gap")
+
+    async def run(self):
+        """Держит подключение, пока задачу не отменят; пауза между попытками растёт до 30 с."""
+        import aiohttp  # есть вместе с aiogram
+
+        if self.backfill is None:
+            from binance_data import get_candles as get_candles_binance
+            self.backfill = get_candles_binance
+
+        delay = 1.0
+        async with aiohttp.ClientSession() as session:
+            while True:
+                try:
+                    async with session.ws_connect(self.stream_url(), heartbeat=30) as ws:
+                        self.connected, self.last_message, delay = True, time.monotonic(), 1.0
+                        self._ready.clear()
+                        logging.info(f"Поток свечей подключён: {len(self.symbols)} символов, {self.interval}")
+                        for symbol in self.symbols:
+                            self._schedule_backfill(symbol, "connect")
+                        async for msg in ws:
+                            if msg.type != aiohttp.WSMsgType.TEXT:
+                                break
+                            self.last_message = time.monotonic()
+                            MESSAGES.inc()
+                            self.handle(json.loads(msg.data))
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logging.warning(f"Поток свечей: {e}")
+                finally:
+                    self.connected = False
+                RECONNECTS.inc()
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+
+_stream = None
+_task = None
+
+def start_stream(symbols, **kwargs) -> KlineStream:
+    """Запустить поток в текущем event loop (повторный вызов перезапускает его)."""
+    global _stream, _task
+    stop_stream()
+    _stream = KlineStream(symbols, **kwargs)
+    _task = asyncio.get_running_loop().create_task(_stream.run())
+    return _stream
+
+def stop_stream():
+    global _stream, _task
+    if _task is not None:
+        _task.cancel()
+    _stream = _task = None
+
+def stream_candles(symbol: str, interval: str, limit: int):
+    """Свечи symbol из потока или None (поток не запущен, символ не подписан или данные не свежие)."""
+    if _stream is None or interval != _stream.interval or stream_symbol(symbol) not in _stream.buffers:
+        return None
+    candles = _stream.candles(symbol, limit)
+    SERVED.inc(result="memory" if candles is not None else "rest")
+    return candles
+
+@register_collector
+def _stream_metrics():
+    if _stream is None:
+        return []
+    return [
+        ("bot_kline_stream_connected", "Поток свечей Binance подключён", "gauge", [({}, float(_stream.connected))]),
+        ("bot_kline_stream_ready_symbols", "Символы, отдаваемые из памяти", "gauge", [({}, len(_stream._ready))]),
+    ]
@@ -1,18 +1,31 @@
+import time
+_process_started = time.perf_counter()  # до тяжёлых импортов — для bot_startup_seconds
+
+import asyncio
 from io import BytesIO
 from aiogram import Bot, Dispatcher, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.filters import CommandStart
 from aiogram.enums import ContentType
-from config import TELEGRAM_BOT_TOKEN, STATE_TTL_SECONDS
-from keyboards import market_keyboard, tickers_keyboard, timeframe_keyboard
+from config import TELEGRAM_BOT_TOKEN, STATE_TTL_SECONDS, SCAN_TOP, KLINE_STREAM_ENABLED, SCREENSHOT_MAX_BYTES
+from keyboards import MARKET_CATEGORIES, market_keyboard, market_tickers, tickers_keyboard, timeframe_keyboard
+from kline_stream import start_stream, stop_stream
+from model_registry import start_preload
 from state import TTLState
-from predictor import analyze
+from predictor import analyze, scan, extract_screenshot
+from metrics import span, render as render_metrics, register_collector
 import logging
 
-from flask import Flask  # Новый импорт
+from flask import Flask, Response  # Новый импорт
 import threading
 
 state = TTLState(STATE_TTL_SECONDS)
+startup_seconds = {"imports": time.perf_counter() - _process_started}
+
+@register_collector
+def _collect_startup():
+    return [("bot_startup_seconds", "Время старта бота по фазам", "gauge",
+             [({"phase": phase}, value) for phase, value in startup_seconds.items()])]
 
 async def start(m: Message):
     await m.answer(
@@ -21,12 +34,27 @@ async def start(m: Message):
         reply_markup=market_keyboard()
     )
 
+async def ingest_screenshot(user_id, bio: BytesIO):
+    """
+    Распознать скриншот сразу после загрузки; в состоянии остаются только свечи и качество
+    или (None, ошибка) — extract_screenshot не выбрасывает исключений.
+    """
+    result = await extract_screenshot(bio.getbuffer())  # без копии, если стадия не в пуле процессов
+    if await state.get(user_id, "screenshot") is asyncio.current_task():  # новый скриншот не пришёл
+        await state.set(user_id, "screenshot", result)
+    return result
+
 async def image_handler(m: Message):
+    upload = m.photo[-1] if m.photo else m.document
+    if upload.file_size and upload.file_size > SCREENSHOT_MAX_BYTES:
+        await m.answer(f"Файл слишком большой (максимум {SCREENSHOT_MAX_BYTES // (1024 * 1024)} МБ)")
+        return
     bio = BytesIO()
-    file_id = m.photo[-1].file_id if m.photo else m.document.file_id
-    file = await m.bot.get_file(file_id)
+    file = await m.bot.get_file(upload.file_id)
     await m.bot.download_file(file.file_path, bio)
-    await state.set(m.from_user.id, "data", bio.getvalue())
+    # Распознавание идёт, пока пользователь выбирает таймфрейм
+    task = asyncio.create_task(ingest_screenshot(m.from_user.id, bio))
+    await state.set(m.from_user.id, "screenshot", task)
     await state.set(m.from_user.id, "mode", "image")
     await m.answer("Выберите таймфрейм:", reply_markup=timeframe_keyboard())
 
@@ -56,23 +84,48 @@ async def callback_handler(cb: CallbackQuery):
         await cb.answer()
         return
 
+    if data.startswith("scan:"):
+        market = data.split(":")[1]
+        await state.set(user_id, "market", market)
+        await state.set(user_id, "mode", "scan")
+        await cb.message.edit_text(f"Сканирование: {market.upper()}\n\nВыберите таймфрейм:", reply_markup=timeframe_keyboard())
+        await cb.answer()
+        return
+
     if data.startswith("tf:"):
         tf = data.split(":")[1]
         logging.info(f"Выбран TF: {tf}")
 
         mode = await state.get(user_id, "mode")
-        if mode == "image":
-            img_data = await state.get(user_id, "data")
-            res, err = await analyze(image_bytes=img_data, tf=tf)
-        else:
-            symbol = await state.get(user_id, "ticker")
-            res, err = await analyze(tf=tf, symbol=symbol)
-
-        if err:
-            await cb.message.answer(f"Ошибка: {err}")
-        else:
-            await send_result(cb.message, res)
-            await cb.message.answer("Готов к новому анализу?", reply_markup=market_keyboard())
+        labels = {"source": {"image": "screenshot", "scan": "scan"}.get(mode, "api"), "tf": tf}
+        with span("analyze", **labels):
+            if mode == "scan":
+                tickers, _ = market_tickers(await state.get(user_id, "market"))
+                res, err = await scan(tickers, tf=tf)
+            elif mode == "image":
+                shot = await state.get(user_id, "screenshot")
+                if isinstance(shot, asyncio.Task):  # ещё распознаётся
+                    shot = await shot
+                if shot is None:  # вытеснен из памяти или истёк
+                    res, err = None, "Скриншот устарел, отправьте его ещё раз"
+                else:
+                    screenshot, err = shot
+                    res = None
+                    if not err:
+                        res, err = await analyze(tf=tf, screenshot=screenshot)
+            else:
+                symbol = await state.get(user_id, "ticker")
+                res, err = await analyze(tf=tf, symbol=symbol)
+
+        with span("telegram_send", **labels):
+            if err:
+                await cb.message.answer(f"Ошибка: {err}")
+            elif mode == "scan":
+                await send_scan_result(cb.message, res)
+                await cb.message.answer("Готов к новому анализу?", reply_markup=market_keyboard())
+            else:
+                await send_result(cb.message, res)
+                await cb.message.answer("Готов к новому анализу?", reply_markup=market_keyboard())
 
         await state.clear(user_id)
         await cb.answer("Готово!")
@@ -86,6 +139,29 @@ async def callback_handler(cb: CallbackQuery):
 
     await cb.answer("Неизвестно")
 
+def recommend(res: dict):
+    """(рекомендация, цвет) по итоговым вероятностям."""
+    if res["up_prob"] >= 0.65:
+        return "🟢 **BUY** (Покупать)", "🟢"
+    if res["down_prob"] >= 0.65:
+        return "🔴 **SELL** (Продавать)", "🔴"
+    return "⚪ **HOLD** (Держать / Наблюдать)", "⚪"
+
+async def send_scan_result(message: Message, res: dict):
+    setups = [r for r in res["results"] if recommend(r)[1] != "⚪"][:SCAN_TOP]
+    txt = f"🔎 **Сканирование | {res['tf']} мин** — проверено {len(res['results'])} тикеров\n\n"
+    if setups:
+        for i, r in enumerate(setups, 1):
+            recommendation, _ = recommend(r)
+            txt += (f"{i}. **{r['symbol']}** {recommendation}: рост {int(r['up_prob'] * 100)}% / "
+                    f"падение {int(r['down_prob'] * 100)}%, {r['regime']}, уверенность {r['confidence']}\n")
+    else:
+        txt += "Сильных BUY/SELL сетапов сейчас нет.\n"
+    if res["failed"]:
+        txt += f"\nНет данных: {', '.join(res['failed'])}\n"
+    txt += "\n⚠ **Не финансовая рекомендация! Торгуйте на свой страх и риск.**"
+    await message.answer(txt, parse_mode="Markdown")
+
 async def send_result(message: Message, res: dict):
     prob = res["prob"]
     growth_percent = int(res["up_prob"] * 100)
@@ -93,15 +169,7 @@ async def send_result(message: Message, res: dict):
     neutral_percent = int(res["neutral_prob"] * 100)
 
     # Определяем рекомендацию
-    if res["up_prob"] >= 0.65:
-        recommendation = "🟢 **BUY** (Покупать)"
-        color = "🟢"
-    elif res["down_prob"] >= 0.65:
-        recommendation = "🔴 **SELL** (Продавать)"
-        color = "🔴"
-    else:
-        recommendation = "⚪ **HOLD** (Держать / Наблюдать)"
-        color = "⚪"
+    recommendation, color = recommend(res)
 
     txt = (
         f"📊 **{res['symbol']} | {res['tf']} мин**\n\n"
@@ -137,9 +205,21 @@ async def send_result(message: Message, res: dict):
 
     await message.answer(txt, parse_mode="Markdown")
 
+async def on_startup():
+    state.start_sweeper()
+    start_preload()
+    if KLINE_STREAM_ENABLED:
+        start_stream(MARKET_CATEGORIES["crypto"])
+
+async def on_shutdown():
+    stop_stream()
+    state.stop_sweeper()
+
 def main():
     bot = Bot(TELEGRAM_BOT_TOKEN)
     dp = Dispatcher()
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
     dp.message.register(start, CommandStart())
     dp.message.register(image_handler, F.content_type.in_({ContentType.PHOTO, ContentType.DOCUMENT}))
     dp.callback_query.register(callback_handler)
@@ -151,11 +231,17 @@ def main():
     def health():
         return "OK", 200
 
+    @app.route('/metrics')
+    def prometheus_metrics():
+        return Response(render_metrics(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
     def run_flask():
         app.run(host='0.0.0.0', port=8080)
 
     threading.Thread(target=run_flask).start()
 
+    startup_seconds["ready"] = time.perf_counter() - _process_started
+    logging.info(f"Старт: импорты {startup_seconds['imports']:.2f} с, готов к работе за {startup_seconds['ready']:.2f} с")
     dp.run_polling(bot)
 
 if __name__ == "__main__":
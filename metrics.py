@@ -0,0 +1,139 @@
+# metrics.py
+import threading
+import time
+from contextlib import contextmanager
+
+# Границы бакетов гистограмм задержек, секунды
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry = []
+_collectors = []
+_caches = []
+_lock = threading.Lock()
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _label_str(labelnames, key, extra=()):
+    pairs = list(zip(labelnames, key)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+def _fmt(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.values = {}
+        _registry.append(self)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with _lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_label_str(self.labelnames, key)} {_fmt(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self.values = {}  # key -> [counts по бакетам, sum, count]
+        _registry.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with _lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(self.values.items()):
+            for bound, c in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_label_str(self.labelnames, key, [('le', _fmt(bound))])} {c}")
+            lines.append(f"{self.name}_sum{_label_str(self.labelnames, key)} {_fmt(total)}")
+            lines.append(f"{self.name}_count{_label_str(self.labelnames, key)} {count}")
+        return lines
+
+
+def register_collector(fn):
+    """fn() -> [(name, help, type, [(labels_dict, value), ...]), ...] — значения снимаются при каждом /metrics."""
+    _collectors.append(fn)
+    return fn
+
+def register_cache(cache):
+    """Кэш с методом stats() -> {"size", "hits", "misses", "coalesced"} и атрибутом name."""
+    _caches.append(cache)
+    return cache
+
+def _collect_caches():
+    stats = [(c.name, c.stats()) for c in _caches]
+    return [
+        ("bot_cache_entries", "Записей в кэше", "gauge", [({"cache": n}, s["size"]) for n, s in stats]),
+        ("bot_cache_hits_total", "Попадания в кэш", "counter", [({"cache": n}, s["hits"]) for n, s in stats]),
+        ("bot_cache_misses_total", "Промахи кэша", "counter", [({"cache": n}, s["misses"]) for n, s in stats]),
+        ("bot_cache_coalesced_total", "Запросы, присоединённые к уже идущей загрузке", "counter",
+         [({"cache": n}, s["coalesced"]) for n, s in stats]),
+    ]
+
+def render() -> str:
+    with _lock:
+        lines = []
+        for metric in _registry:
+            lines.extend(metric.render())
+    for collect in [_collect_caches] + _collectors:
+        for name, help, kind, samples in collect():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_label_str(labels.keys(), labels.values())} {_fmt(value)}")
+    return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = Histogram(
+    "bot_stage_seconds", "Длительность стадий анализа и обработки callback", ("stage", "source", "tf")
+)
+PROVIDER_SECONDS = Histogram(
+    "bot_provider_request_seconds", "Длительность запросов к внешним API", ("provider",)
+)
+PROVIDER_ERRORS = Counter(
+    "bot_provider_errors_total", "Ошибки внешних API", ("provider",)
+)
+
+@contextmanager
+def span(stage: str, **labels):
+    """Замер длительности блока в bot_stage_seconds."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage, **labels)
+
+@contextmanager
+def provider_call(provider: str):
+    """Замер запроса к провайдеру; исключение внутри блока считается ошибкой."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        PROVIDER_ERRORS.inc(provider=provider)
+        raise
+    finally:
+        PROVIDER_SECONDS.observe(time.perf_counter() - started, provider=provider)
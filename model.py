@@ -1,35 +1,98 @@
 # model.py
 import numpy as np
-from sklearn.ensemble import RandomForestClassifier
-import joblib
 import os
 import logging
+from config import MODEL_BACKEND, FLAT_FOREST_MAX_ROWS
+from forest import FlatForest
+
+def file_version(path):
+    """(mtime_ns, size) файла или None, если его нет."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+def save_model(obj, path):
+    """Атомарная запись без сжатия: читатели видят либо старый, либо новый файл целиком,
+    а открытые через mmap старые версии не портятся (os.replace меняет inode)."""
+    import joblib
+    tmp = f"{path}.tmp{os.getpid()}"
+    joblib.dump(obj, tmp)
+    os.replace(tmp, path)
 
 class CandleModel:
     def __init__(self, tf: str):
         self.tf = tf
         self.model_path = f"models/model_{tf}m.joblib"
+        self.flat_path = f"models/model_{tf}m.flat.joblib"  # кэш FlatForest рядом с моделью
         self.model = None
+        self.flat = None
+        self.n_jobs = None  # потоки sklearn-леса; None — как сохранил train_models (n_jobs=-1)
         self.fallback = True
+        self.version = file_version(self.model_path)
         self.load_model()
 
     def load_model(self):
-        if os.path.exists(self.model_path):
-            try:
-                self.model = joblib.load(self.model_path)
-                self.fallback = False
-                logging.info(f"Загружена обученная модель для {self.tf}m")
-            except Exception as e:
-                logging.error(f"Ошибка загрузки модели {self.tf}m: {e}")
-        else:
+        if not os.path.exists(self.model_path):
             logging.info(f"Обученная модель для {self.tf}m не найдена — используется fallback")
+            return
+        try:
+            if MODEL_BACKEND == "flat":
+                try:
+                    self.flat = self._load_flat()
+                except Exception as e:
+                    logging.warning(f"Модель {self.tf}m не развёрнута в массивы, инференс через sklearn: {e}")
+            if self.flat is None:
+                self._load_sklearn()
+            self.fallback = False
+            logging.info(f"Загружена обученная модель для {self.tf}m")
+        except Exception as e:
+            logging.error(f"Ошибка загрузки модели {self.tf}m: {e}")
+
+    def _load_sklearn(self):
+        """sklearn-лес нужен только без кэша FlatForest и для больших пакетов — грузится по требованию."""
+        if self.model is None:
+            import joblib  # вместе с моделью подтянется и sklearn
+            # Без mmap: sklearn при загрузке всё равно копирует массивы узлов (Tree.__setstate__)
+            self.model = joblib.load(self.model_path)
+            if self.n_jobs is not None:
+                self.model.set_params(n_jobs=self.n_jobs)
+        return self.model
+
+    def set_n_jobs(self, n_jobs):
+        """Ограничить потоки sklearn-леса (процессам, которые сами делят ядра между собой)."""
+        self.n_jobs = n_jobs
+        if self.model is not None:
+            self.model.set_params(n_jobs=n_jobs)
+
+    def _load_flat(self):
+        import joblib
+        if os.path.exists(self.flat_path):
+            flat = joblib.load(self.flat_path, mmap_mode="r")
+            if getattr(flat, "source_version", None) == self.version:
+                return flat
+        flat = FlatForest.from_sklearn(self._load_sklearn())
+        self.model = None  # не держать оба леса: для больших пакетов _load_sklearn загрузит его снова
+        flat.source_version = self.version  # кэш действителен только для этой версии файла модели
+        try:
+            save_model(flat, self.flat_path)
+            return joblib.load(self.flat_path, mmap_mode="r")
+        except OSError as e:
+            logging.warning(f"Не удалось сохранить {self.flat_path}: {e}")
+            return flat
+
+    def file_changed(self) -> bool:
+        return file_version(self.model_path) != self.version
 
     def predict_proba(self, X):
         if X.shape[0] == 0:
             return np.array([[0.333, 0.333, 0.333]])  # Для 3 классов
 
-        if not self.fallback and self.model is not None:
-            probs = self.model.predict_proba(X)
+        if not self.fallback:
+            if self.flat is not None and X.shape[0] <= FLAT_FOREST_MAX_ROWS:
+                return self.flat.predict_proba(X)
+            probs = self._load_sklearn().predict_proba(X)
             # Порядок классов: [-1, 0, 1] (падение, нейтрал, рост)
             return probs
 
@@ -1,13 +1,76 @@
 # model_registry.py
+import asyncio
+import logging
+import threading
+import time
+from config import MODEL_RELOAD_CHECK_SECONDS
 from model import CandleModel
 
-# Создаём модели при старте
-MODELS = {
-    "1": CandleModel("1"),
-    "2": CandleModel("2"),
-    "5": CandleModel("5"),
-    "10": CandleModel("10"),
-}
+TIMEFRAMES = ("1", "2", "5", "10")
+
+# Модели создаются при первом обращении к таймфрейму
+MODELS = {}
+_checked_at = {}     # tf -> когда последний раз проверяли файл модели
+_reloading = set()
+_lock = threading.Lock()
+_preload = None
 
 def get_model(tf: str):
-    return MODELS.get(tf, MODELS["1"])
+    """Синхронный доступ (скрипты, потоки). Первый вызов строит модель — в event loop нужен load_model."""
+    tf = tf if tf in TIMEFRAMES else "1"
+    model = MODELS.get(tf)
+    if model is None:
+        with _lock:
+            model = MODELS.get(tf)
+            if model is None:
+                model = MODELS[tf] = CandleModel(tf)
+                _checked_at[tf] = time.monotonic()
+        return model
+
+    now = time.monotonic()
+    if MODEL_RELOAD_CHECK_SECONDS > 0 and now - _checked_at.get(tf, 0) >= MODEL_RELOAD_CHECK_SECONDS:
+        _checked_at[tf] = now
+        if model.file_changed() and tf not in _reloading:
+            _reloading.add(tf)
+            threading.Thread(target=_reload, args=(tf, model), name=f"model-reload-{tf}", daemon=True).start()
+    return model
+
+async def load_model(tf: str):
+    """
+    get_model для event loop: первая загрузка (joblib, сборка FlatForest) идёт в потоке,
+    остальные запросы тем временем обслуживаются. Уже загруженная модель отдаётся сразу.
+    """
+    tf = tf if tf in TIMEFRAMES else "1"
+    if tf in MODELS:
+        return get_model(tf)
+    return await asyncio.get_running_loop().run_in_executor(None, get_model, tf)
+
+async def _preload_all():
+    for tf in TIMEFRAMES:
+        try:
+            await load_model(tf)
+        except Exception as e:
+            logging.error(f"Не удалось загрузить модель {tf}m: {e}")
+
+def start_preload():
+    """Загрузить модели всех таймфреймов в фоне при старте, не дожидаясь первых запросов."""
+    global _preload
+    if _preload is None or _preload.done():
+        _preload = asyncio.get_running_loop().create_task(_preload_all())
+
+def _reload(tf: str, current: CandleModel):
+    """Загрузить новую версию в фоне и подменить одной операцией присваивания:
+    запросы, уже взявшие старую модель, дорабатывают с ней."""
+    try:
+        fresh = CandleModel(tf)
+        if fresh.fallback and not current.fallback:
+            # Файл удалён или битый — остаёмся на текущей версии до следующего изменения
+            logging.error(f"Новая модель {tf}m не загрузилась, остаётся текущая")
+            current.version = fresh.version
+            return
+        MODELS[tf] = fresh
+        logging.info(f"Модель {tf}m обновлена без перезапуска")
+    except Exception as e:
+        logging.error(f"Ошибка перезагрузки модели {tf}m: {e}")
+    finally:
+        _reloading.discard(tf)
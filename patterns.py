@@ -1,5 +1,112 @@
 import numpy as np
-from trend import trend_signal  # добавляем импорт
+from candle_array import as_candles
+from trend import trend_signal, trend_signal_series  # добавляем импорт
+
+# Столбцы матрицы scan_patterns
+PATTERNS = (
+    "Engulfing", "Marubozu", "Hammer", "Shooting Star", "Pinbar", "Doji",
+    "Morning Star", "Evening Star", "Three White Soldiers", "Three Black Crows",
+    "Bullish Harami", "Bearish Harami",
+)
+_COL = {name: i for i, name in enumerate(PATTERNS)}
+
+# Паттерны, усиливаемые совпадающим трендом
+_BULLISH = [_COL["Hammer"], _COL["Morning Star"], _COL["Bullish Harami"]]
+_BEARISH = [_COL["Shooting Star"], _COL["Evening Star"], _COL["Bearish Harami"]]
+
+
+def _lag(a, k):
+    """Ряд, сдвинутый на k баров назад (значение бара i - k в позиции i), начало заполнено нулями."""
+    if k == 0:
+        return a
+    out = np.zeros_like(a)
+    out[k:] = a[:-k]
+    return out
+
+
+def _scan(candles):
+    """
+    Паттерны и сырой счёт (без поправки на тренд) для каждого бара.
+    Строка i совпадает с тем, что detect_patterns находит в последних 3 свечах candles[:i+1].
+    """
+    n = len(candles)
+    flags = np.zeros((n, len(PATTERNS)), dtype=bool)
+    score = np.zeros(n)
+    if n < 3:
+        return flags, score
+
+    o, cl, h, l = candles["open"], candles["close"], candles["high"], candles["low"]
+    body = np.abs(cl - o)
+    range_ = h - l
+    upper_wick = h - np.maximum(o, cl)
+    lower_wick = np.minimum(o, cl) - l
+    direction = np.where(cl > o, 1, -1)
+
+    # Однобаровые признаки
+    engulfing = np.zeros(n, dtype=bool)
+    engulfing[1:] = (body[1:] > body[:-1] * 1.5) & (direction[1:] == -np.sign(cl[:-1] - o[:-1]))
+    marubozu = body > range_ * 0.85
+    hammer_like = (body < range_ * 0.4) & (lower_wick > body * 2) & (upper_wick < body)
+    pinbar = ((lower_wick > body * 2) & (upper_wick < body * 0.5)) | ((upper_wick > body * 2) & (lower_wick < body * 0.5))
+    doji = body < range_ * 0.1
+
+    single = [
+        ("Engulfing", engulfing, 0.25),
+        ("Marubozu", marubozu, 0.20),
+        ("Hammer", hammer_like & (direction > 0), 0.22),
+        ("Shooting Star", hammer_like & (direction < 0), 0.22),
+        ("Pinbar", pinbar, 0.18),
+        ("Doji", doji, 0.10),
+    ]
+    # Окно из трёх последних баров; Engulfing у самого старого из них не проверяется.
+    # Порядок сложения тот же, что в исходном цикле, — счёт совпадает до бита.
+    for k in (2, 1, 0):
+        for name, flag, weight in single:
+            if name == "Engulfing" and k == 2:
+                continue
+            hit = _lag(flag, k)
+            flags[:, _COL[name]] |= hit
+            score += np.where(hit, weight, 0.0)
+
+    # 3-свечные: c1 = i-2, c2 = i-1, c3 = i
+    o1, o2, o3 = _lag(o, 2), _lag(o, 1), o
+    c1, c2, c3 = _lag(cl, 2), _lag(cl, 1), cl
+    small_middle = np.abs(c2 - o2) < np.abs(c1 - o1) * 0.3
+    triple = [
+        ("Morning Star", (c1 < o1) & small_middle & (c3 > o3) & (c3 > (o1 + c1) / 2), 0.28),
+        ("Evening Star", (c1 > o1) & small_middle & (c3 < o3) & (c3 < (o1 + c1) / 2), 0.28),
+        ("Three White Soldiers", (c1 > o1) & (c2 > o2) & (c3 > o3) & (c2 > c1) & (c3 > c2), 0.30),
+        ("Three Black Crows", (c1 < o1) & (c2 < o2) & (c3 < o3) & (c2 < c1) & (c3 < c2), 0.30),
+        ("Bullish Harami", (c1 < o1) & (c3 > o3) & (o3 > c1) & (c3 < o1), 0.20),
+        ("Bearish Harami", (c1 > o1) & (c3 < o3) & (o3 < c1) & (c3 > o1), 0.20),
+    ]
+    for name, hit, weight in triple:
+        flags[:, _COL[name]] = hit
+        score += np.where(hit, weight, 0.0)
+
+    # Первым двум барам не хватает окна
+    flags[:2] = False
+    score[:2] = 0.0
+    return flags, score
+
+
+def _trend_boost(flags, score, trend_prob):
+    """Улучшение: усиление паттернов в соответствии с трендом."""
+    boost = ((trend_prob > 0.65) & flags[..., _BULLISH].any(axis=-1)) | \
+            ((trend_prob < 0.35) & flags[..., _BEARISH].any(axis=-1))
+    score = np.where(boost, np.minimum(score * 1.3, 1.0), score)
+    return np.minimum(score, 1.0)
+
+
+def scan_patterns(candles):
+    """
+    Все паттерны по всей истории за один проход.
+    Возвращает (flags[n, len(PATTERNS)], score[n]); строка i — результат detect_patterns(candles[:i+1]).
+    """
+    candles = as_candles(candles)
+    flags, score = _scan(candles)
+    return flags, _trend_boost(flags, score, trend_signal_series(candles))
+
 
 def detect_patterns(candles):
     patterns = []
@@ -7,90 +114,9 @@ def detect_patterns(candles):
     if len(candles) < 3:
         return patterns, score
 
-    for i in range(-3, 0):
-        prev = candles[i-1] if i > -3 else candles[0]
-        c = candles[i]
-        o, cl, h, l = c["open"], c["close"], c["high"], c["low"]
-        body = abs(cl - o)
-        range_ = h - l
-        upper_wick = h - max(o, cl)
-        lower_wick = min(o, cl) - l
-        direction = 1 if cl > o else -1
-
-        # Engulfing
-        if i > -3:
-            prev_body = abs(prev["close"] - prev["open"])
-            if body > prev_body * 1.5 and direction == -np.sign(prev["close"] - prev["open"]):
-                patterns.append("Engulfing")
-                score += 0.25
-
-        # Marubozu
-        if body > range_ * 0.85:
-            patterns.append("Marubozu")
-            score += 0.20
-
-        # Hammer / Shooting Star
-        if body < range_ * 0.4 and lower_wick > body * 2 and upper_wick < body:
-            patterns.append("Hammer" if direction > 0 else "Shooting Star")
-            score += 0.22
-
-        # Pinbar
-        if (lower_wick > body * 2 and upper_wick < body * 0.5) or (upper_wick > body * 2 and lower_wick < body * 0.5):
-            patterns.append("Pinbar")
-            score += 0.18
-
-        # Doji
-        if body < range_ * 0.1:
-            patterns.append("Doji")
-            score += 0.10
-
-    # 3-свечные
-    if len(candles) >= 3:
-        c1, c2, c3 = candles[-3], candles[-2], candles[-1]
-
-        # Morning Star
-        if (c1["close"] < c1["open"] and
-            abs(c2["close"] - c2["open"]) < abs(c1["close"] - c1["open"]) * 0.3 and
-            c3["close"] > c3["open"] and
-            c3["close"] > (c1["open"] + c1["close"]) / 2):
-            patterns.append("Morning Star")
-            score += 0.28
-
-        # Evening Star
-        if (c1["close"] > c1["open"] and
-            abs(c2["close"] - c2["open"]) < abs(c1["close"] - c1["open"]) * 0.3 and
-            c3["close"] < c3["open"] and
-            c3["close"] < (c1["open"] + c1["close"]) / 2):
-            patterns.append("Evening Star")
-            score += 0.28
-
-        # Three White Soldiers
-        if all(c["close"] > c["open"] for c in [c1, c2, c3]) and c2["close"] > c1["close"] and c3["close"] > c2["close"]:
-            patterns.append("Three White Soldiers")
-            score += 0.30
-
-        # Three Black Crows
-        if all(c["close"] < c["open"] for c in [c1, c2, c3]) and c2["close"] < c1["close"] and c3["close"] < c2["close"]:
-            patterns.append("Three Black Crows")
-            score += 0.30
-
-        # Bullish Harami
-        if c1["close"] < c1["open"] and c3["close"] > c3["open"] and c3["open"] > c1["close"] and c3["close"] < c1["open"]:
-            patterns.append("Bullish Harami")
-            score += 0.20
-
-        # Bearish Harami
-        if c1["close"] > c1["open"] and c3["close"] < c3["open"] and c3["open"] < c1["close"] and c3["close"] > c1["open"]:
-            patterns.append("Bearish Harami")
-            score += 0.20
-
-    patterns = list(set(patterns))
-
-    # Улучшение: усиление паттернов в соответствии с трендом
-    trend_prob = trend_signal(candles)
-    if trend_prob > 0.65 and any("bull" in p.lower() or "hammer" in p.lower() or "morning" in p.lower() for p in patterns):
-        score = min(score * 1.3, 1.0)
-    elif trend_prob < 0.35 and any("bear" in p.lower() or "shooting" in p.lower() or "evening" in p.lower() for p in patterns):
-        score = min(score * 1.3, 1.0)
-
-    return patterns, min(score, 1.0)
+    candles = as_candles(candles)
+    flags, raw = _scan(candles[-3:])  # для последнего бара достаточно трёх свечей
+    flags, raw = flags[-1], raw[-1]
+    patterns = [name for name, hit in zip(PATTERNS, flags) if hit]
+    score = float(_trend_boost(flags, raw, trend_signal(candles)))
+    return patterns, score
@@ -1,15 +1,23 @@
-import httpx
-import os
+import asyncio
 import logging
+import math
+import time
 import numpy as np
 
 from features import build_features
 from patterns import detect_patterns
 from trend import trend_signal, market_regime
 from confidence import confidence_from_probs
-from model_registry import get_model
+from model_registry import load_model
 from data_provider import get_candles
-from cv_extractor import extract_candles
+from bar_cache import SingleFlightCache, interval_seconds, next_bar_close
+from indicator_stream import get_stream
+from candle_array import as_candles, has_time
+from executors import run_stage, in_process, StageError
+from grok_client import ask_grok, grok_enabled
+from config import GROK_FAILURE_CACHE_SECONDS
+from metrics import span, register_cache
+from rate_limiter import priority, BATCH, RateLimited
 # Исправленный импорт — добавлены compute_stochastic и compute_adx_strength
 from indicators import (
     compute_rsi,
@@ -24,11 +32,35 @@ from indicators import (
     compute_parabolic_sar
 )
 
-XAI_API_KEY = os.getenv("XAI_API_KEY")
-GROK_MODEL = "grok-4"
+# Веса [ml, patterns, trend, grok]: для tf <= 5 — "scalp", иначе по режиму рынка
+BLEND_WEIGHTS = {
+    "scalp": [0.20, 0.30, 0.20, 0.30],
+    "trend": [0.30, 0.25, 0.20, 0.25],
+    "flat": [0.15, 0.40, 0.20, 0.25],
+    "volatile": [0.20, 0.30, 0.25, 0.25],
+}
+
+def blend_weights(tf, regime, table=BLEND_WEIGHTS):
+    if int(tf or 0) <= 5:
+        return table["scalp"]
+    return table.get(regime, table["volatile"])
+
+def blend(weights, ml_prob_up, ml_prob_down, pattern_score, trend_prob, grok_prob):
+    """
+    (final_prob_up, final_prob_down, final_prob). Работает и со скалярами, и с рядами:
+    weights формы (4,) или (n, 4), вероятности — числа или массивы длины n.
+    """
+    weights = np.asarray(weights, dtype=float)
+    up = np.stack(np.broadcast_arrays(ml_prob_up, pattern_score, trend_prob, grok_prob), axis=-1)
+    down = np.stack(np.broadcast_arrays(ml_prob_down, 1 - pattern_score, 1 - trend_prob, 1 - grok_prob), axis=-1)  # Симметрично
+    final_prob_up = np.einsum("...i,...i->...", weights, up)
+    final_prob_down = np.einsum("...i,...i->...", weights, down)
+    final_prob = final_prob_up - final_prob_down + 0.5  # Нормализуем к 0-1
+    return final_prob_up, final_prob_down, final_prob
 
 async def call_grok(candles, patterns, regime, tf, symbol, indicators):
-    if not XAI_API_KEY:
+    """Вероятность роста от Grok; None, если xAI не ответил или квота исчерпана."""
+    if not grok_enabled():
         logging.warning("Grok отключён (нет ключа)")
         return 0.5
 
@@ -56,92 +88,199 @@ async def call_grok(candles, patterns, regime, tf, symbol, indicators):
 
 Вероятность роста на 2–3 свечи? Только число 0.00-1.00"""
 
+    # Один и тот же бар с тем же промптом не отправляется в xAI повторно
+    last_bar = int(candles["time"][-1]) if has_time(candles) else None
+    return await ask_grok(prompt, key=(symbol, tf, last_bar))
+
+def tf_interval(tf: str) -> str:
+    return tf + "m"
+
+async def extract_screenshot(image, tf: str = ""):
+    """
+    Свечи со скриншота (bytes или memoryview) -> ((candles, quality), None) или (None, ошибка).
+    Вызывается один раз при загрузке: дальше для любого таймфрейма нужен только результат.
+    """
+    if isinstance(image, memoryview) and in_process("extract"):
+        image = bytes(image)  # memoryview не передаётся в другой процесс через pickle
     try:
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            resp = await client.post(
-                "https://api.x.ai/v1/chat/completions",
-                headers={"Authorization": f"Bearer {XAI_API_KEY}", "Content-Type": "application/json"},
-                json={
-                    "model": GROK_MODEL,
-                    "messages": [{"role": "user", "content": prompt}],
-                    "temperature": 0.2,
-                    "max_tokens": 8
-                }
-            )
-            if resp.status_code != 200:
-                logging.error(f"Grok error {resp.status_code}: {resp.text}")
-                return 0.5
-            txt = resp.json()["choices"][0]["message"]["content"].strip()
-            prob = float(txt) if txt.replace(".", "").isdigit() else 0.5
-            return prob
-    except Exception as e:
-        logging.error(f"Grok exception: {e}")
-        return 0.5
+        from cv_extractor import extract_candles  # OpenCV загружается только с первым скриншотом
+        with span("extract", source="screenshot", tf=tf):
+            return await run_stage("extract", extract_candles, image), None
+    except StageError as e:
+        return None, str(e)
+    except ValueError as e:
+        logging.warning(f"Скриншот не распознан: {e}")
+        return None, "Не удалось распознать изображение"
+    except Exception as e:  # cv2.error на повреждённом файле, ошибки пула процессов и т. п.
+        logging.error(f"Ошибка распознавания скриншота: {e}")
+        return None, "Не удалось распознать изображение"
+
+class AnalysisError(Exception):
+    """Анализ не выполнен (текст — для пользователя); такие исходы не кэшируются."""
 
-async def analyze(tf: str = "1", symbol: str = None, image_bytes: bytes = None):
-    source = "Скриншот"
-    quality = 0.0
-    candles = []
+# Результаты analyze по API до закрытия бара: (symbol, tf, последний закрытый бар, версия модели)
+analysis_cache = register_cache(SingleFlightCache("analysis"))
+_model_versions = {}  # tf -> версия модели, с которой посчитаны результаты в analysis_cache
 
-    if image_bytes:
-        candles, quality = extract_candles(image_bytes)
-    else:
-        interval = tf + "m" if tf != "10" else "1h"  # пример
-        candles = get_candles(symbol, interval=interval, limit=70)
-        source = "Twelve Data / Binance"
+async def analyze(tf: str = "1", symbol: str = None, image_bytes: bytes = None, screenshot=None):
+    """screenshot — готовый результат extract_screenshot (candles, quality); image_bytes распознаётся на месте."""
+    try:
+        if screenshot is None and not image_bytes:
+            return await _analyze_cached(tf, symbol), None
+        if screenshot is None:
+            screenshot, err = await extract_screenshot(image_bytes, tf)
+            if err:
+                return None, err
+        candles, quality = screenshot
+        return await _analyze(candles, tf, None, {"source": "screenshot", "tf": tf}, "Скриншот", quality), None
+    except AnalysisError as e:
+        return None, str(e)
+
+async def _analyze_cached(tf, symbol):
+    """
+    Запросы одного (symbol, tf) в пределах бара получают один результат, одновременные —
+    ждут одно вычисление (свечи, модель, Grok). Перезагрузка модели сбрасывает её результаты.
+    """
+    version = (await load_model(tf)).version
+    if _model_versions.get(tf, version) != version:
+        analysis_cache.discard(lambda key: key[1] == tf)
+    _model_versions[tf] = version
+
+    interval = tf_interval(tf)
+    step = interval_seconds(interval)
+    last_closed = int(time.time() // step - 1) * step
+    key = (symbol.upper(), tf, last_closed, version)
+    bar_close = next_bar_close(interval)
+
+    def expires_at(res):
+        # Нейтральные 0.5 вместо ответа Grok не держим до конца бара: одновременные запросы
+        # по-прежнему объединяются, а через GROK_FAILURE_CACHE_SECONDS Grok спрашивают снова
+        if res.get("grok_failed"):
+            return min(bar_close, time.time() + GROK_FAILURE_CACHE_SECONDS)
+        return bar_close
+
+    return await analysis_cache.get_or_load(key, lambda: _analyze_api(tf, symbol), expires_at=expires_at)
+
+async def _analyze_api(tf, symbol):
+    labels = {"source": "api", "tf": tf}
+    # Ошибки загрузки — AnalysisError: пользователь получает ответ, а в analysis_cache ничего не попадает
+    try:
+        with span("fetch", **labels):
+            candles = await get_candles(symbol, interval=tf_interval(tf), limit=70)
+    except RateLimited as e:
+        when = f"через {math.ceil(e.retry_after)} с" if e.retry_after else "чуть позже"
+        raise AnalysisError(f"Достигнут лимит запросов к провайдеру данных, попробуйте {when}")
+    except RuntimeError as e:
+        logging.error(f"Свечи {symbol} {tf}m: {e}")
+        raise AnalysisError("Не удалось получить данные по тикеру")
+    return await _analyze(candles, tf, symbol, labels, "Twelve Data / Binance", 0.0)
 
+async def _analyze(candles, tf, symbol, labels, source, quality):
     if len(candles) < 5:
-        return None, "Мало свечей"
-
-    closes = np.array([c["close"] for c in candles])
-    highs = np.array([c["high"] for c in candles])
-    lows = np.array([c["low"] for c in candles])
-
-    indicators = {
-        "rsi": compute_rsi(closes),
-        "macd": compute_macd(closes),
-        "bb": compute_bollinger(closes),
-        "ema": compute_ema(closes[-20:] if len(closes) >= 20 else closes),
-        "closes": closes,
-        "stoch": compute_stochastic(closes, highs, lows),
-        "adx": compute_adx_strength(highs, lows, closes),
-        "atr": compute_atr(highs, lows, closes),
-        "cci": compute_cci(highs, lows, closes),
-        "psar": compute_parabolic_sar(highs, lows, closes),
-    }
+        raise AnalysisError("Мало свечей")
+
+    try:
+        candles, indicators, x = await _prepare(candles, tf, symbol, labels)
+        model = await load_model(tf)
+        with span("model", **labels):
+            ml_probs = (await run_stage("predict", model.predict_proba, x.reshape(1, -1)))[0]  # [prob_down, prob_neutral, prob_up]
+    except StageError as e:
+        raise AnalysisError(str(e))
+
+    return await _decide(candles, indicators, ml_probs, tf, symbol, labels, source, quality)
+
+async def scan(tickers, tf: str = "1"):
+    """
+    Все тикеры категории за один проход: свечи и признаки — параллельно, модель — одним
+    вызовом predict_proba на матрице из последних строк признаков. Результаты отсортированы
+    по силе сигнала (|prob - 0.5|), сильнейшие BUY/SELL — первыми.
+    """
+    labels = {"source": "scan", "tf": tf}
+    # Запросы сканирования уступают провайдерам место одиночным анализам
+    with span("fetch", **labels), priority(BATCH):
+        fetched = await asyncio.gather(
+            *(get_candles(s, interval=tf_interval(tf), limit=70) for s in tickers), return_exceptions=True
+        )
+    ready, failed = [], []
+    for symbol, candles in zip(tickers, fetched):
+        if isinstance(candles, Exception) or len(candles) < 5:
+            failed.append(symbol)
+        else:
+            ready.append((symbol, candles))
+    if not ready:
+        return None, "Не удалось получить данные ни по одному тикеру"
+
+    try:
+        prepared = await asyncio.gather(*(_prepare(c, tf, s, labels) for s, c in ready))
+        X = np.vstack([x for _, _, x in prepared])
+        model = await load_model(tf)
+        with span("model", **labels):
+            probs = await run_stage("predict", model.predict_proba, X)
+    except StageError as e:
+        return None, str(e)
+
+    with priority(BATCH):
+        results = await asyncio.gather(*(
+            _decide(candles, indicators, ml_probs, tf, symbol, labels, "Twelve Data / Binance", 0.0)
+            for (symbol, _), (candles, indicators, _), ml_probs in zip(ready, prepared, probs)
+        ))
+    results.sort(key=lambda r: abs(r["prob"] - 0.5), reverse=True)
+    return {"tf": tf, "results": results, "failed": failed}, None
 
-    features = build_features(candles, tf)
+async def _prepare(candles, tf, symbol, labels):
+    """Индикаторы и строка признаков последнего бара — всё, что нужно до модели."""
+    candles = as_candles(candles)
+
+    with span("indicators", **labels):
+        closes, highs, lows = candles["close"], candles["high"], candles["low"]
+
+        if symbol and has_time(candles):
+            # Поток по (symbol, tf) принимает только новые бары — без пересчёта всей истории
+            indicators = get_stream(symbol, tf).sync(candles).snapshot()
+        else:
+            indicators = {
+                "rsi": compute_rsi(closes),
+                "macd": compute_macd(closes),
+                "bb": compute_bollinger(closes),
+                "ema": compute_ema(closes[-20:] if len(closes) >= 20 else closes),
+                "stoch": compute_stochastic(closes, highs, lows),
+                "adx": compute_adx_strength(highs, lows, closes),
+                "atr": compute_atr(highs, lows, closes),
+                "cci": compute_cci(highs, lows, closes),
+                "psar": compute_parabolic_sar(highs, lows, closes),
+            }
+        indicators["closes"] = closes
+
+    with span("features", **labels):
+        features = await run_stage("features", build_features, candles, tf)
     if features is None or features.size == 0 or len(features) == 0:
         features = np.array([[0.1, 0.0, 0.1]])
 
-    X = features[-1].reshape(1, -1)
-    ml_probs = get_model(tf).predict_proba(X)[0]  # [prob_down, prob_neutral, prob_up]
+    return candles, indicators, features[-1]
+
+async def _decide(candles, indicators, ml_probs, tf, symbol, labels, source, quality):
+    """Паттерны, режим, тренд, Grok и итоговое взвешивание поверх вероятностей модели."""
     ml_prob_up = ml_probs[2]  # Для старой логики
     ml_prob_down = ml_probs[0]
 
-    patterns, pattern_score = detect_patterns(candles)
+    with span("patterns", **labels):
+        patterns, pattern_score = detect_patterns(candles)
 
-    regime = market_regime(candles)
-    scalp_adj = scalping_strategy(indicators, patterns, regime)
-    pattern_score = np.clip(pattern_score + scalp_adj, 0.0, 1.0)
+        regime = market_regime(candles)
+        scalp_adj = scalping_strategy(indicators, patterns, regime)
+        pattern_score = np.clip(pattern_score + scalp_adj, 0.0, 1.0)
 
-    trend_prob = trend_signal(candles)
+        trend_prob = trend_signal(candles)
 
-    grok_prob = await call_grok(candles, patterns, regime, tf, symbol or "Неизвестно", indicators)
+    with span("grok", **labels):
+        grok_prob = await call_grok(candles, patterns, regime, tf, symbol or "Неизвестно", indicators)
+    grok_failed = grok_prob is None
+    if grok_failed:
+        grok_prob = 0.5
 
     # Взвешивание вероятностей
-    if int(tf or 0) <= 5:
-        weights = [0.20, 0.30, 0.20, 0.30]  # ml, patterns, trend, grok
-    elif regime == "trend":
-        weights = [0.30, 0.25, 0.20, 0.25]
-    elif regime == "flat":
-        weights = [0.15, 0.40, 0.20, 0.25]
-    else:
-        weights = [0.20, 0.30, 0.25, 0.25]
-
-    final_prob_up = np.dot(weights, [ml_prob_up, pattern_score, trend_prob, grok_prob])
-    final_prob_down = np.dot(weights, [ml_prob_down, 1 - pattern_score, 1 - trend_prob, 1 - grok_prob])  # Симметрично
-    final_prob = final_prob_up - final_prob_down + 0.5  # Нормализуем к 0-1
+    weights = blend_weights(tf, regime)
+    final_prob_up, final_prob_down, final_prob = blend(weights, ml_prob_up, ml_prob_down, pattern_score, trend_prob, grok_prob)
 
     conf_label, conf_score = confidence_from_probs([ml_prob_up, pattern_score, trend_prob, grok_prob, ml_prob_down])  # Добавил down
 
@@ -158,5 +297,6 @@ async def analyze(tf: str = "1", symbol: str = None, image_bytes: bytes = None):
         "symbol": symbol or "Скриншот",
         "source": source,
         "quality": quality,
+        "grok_failed": grok_failed,
         "indicators": indicators
-    }, None
+    }
@@ -0,0 +1,206 @@
+# rate_limiter.py
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from config import RATE_LIMITS, RATE_LIMIT_MAX_WAIT_SECONDS
+from metrics import Counter, Histogram, register_collector
+
+# Приоритеты запросов: меньше — раньше
+INTERACTIVE, BATCH, BACKGROUND = 0, 1, 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch", BACKGROUND: "background"}
+
+# Приоритет наследуется задачами (asyncio копирует контекст), поэтому его не нужно
+# передавать через все вызовы: достаточно обернуть верхний уровень в with priority(...)
+_priority = contextvars.ContextVar("rate_priority", default=INTERACTIVE)
+
+WAIT_SECONDS = Histogram(
+    "bot_rate_limit_wait_seconds", "Ожидание слота в лимите провайдера", ("provider", "priority"),
+    buckets=(0.001, 0.01, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+REJECTED = Counter(
+    "bot_rate_limit_rejected_total", "Запросы, не дождавшиеся слота", ("provider", "priority")
+)
+THROTTLED = Counter(
+    "bot_rate_limit_throttled_total", "Ответы провайдера о превышении лимита (429)", ("provider",)
+)
+
+class RateLimited(RuntimeError):
+    """Квота провайдера исчерпана: запрос не дождался слота. retry_after — оценка паузы, с."""
+
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+@contextmanager
+def priority(level: int):
+    """Все запросы внутри блока (и запущенных из него задач) идут с приоритетом level."""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    """
+    per_minute запросов в минуту со всплеском до burst. Ожидающие обслуживаются
+    по приоритету, внутри приоритета — по очереди; после 429 провайдер блокируется
+    на Retry-After, пока квота не восстановится.
+    """
+
+    def __init__(self, name: str, per_minute: float, burst: int):
+        self.name = name
+        self.rate = per_minute / 60.0
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        # Квота по заголовкам ответа, если провайдер её сообщает
+        self.quota_remaining = None
+        self.quota_used = None
+        self._waiters = []  # heap (priority, seq, future)
+        self._seq = itertools.count()
+        self._loop = None
+        self._task = None
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _take(self, now) -> bool:
+        self._refill(now)
+        if now >= self.blocked_until and self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def _available(self, now) -> float:
+        """Токены на момент now без изменения состояния корзины."""
+        return min(self.burst, self.tokens + (now - self.updated) * self.rate)
+
+    def retry_after(self, now) -> float:
+        """Через сколько секунд появится следующий токен (без учёта очереди)."""
+        return max(self.blocked_until - now, (1 - self._available(now)) / self.rate, 0.0)
+
+    def queued(self) -> dict:
+        counts = {level: 0 for level in PRIORITY_NAMES}
+        for level, _, future in self._waiters:
+            if not future.done():
+                counts[level] += 1
+        return counts
+
+    async def acquire(self, timeout: float = None):
+        level = _priority.get()
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:  # новый event loop (asyncio.run в скриптах) — старые ожидающие не нужны
+            self._loop, self._task, self._waiters = loop, None, []
+
+        started = time.monotonic()
+        if timeout is not None and self.blocked_until - started > timeout:
+            # После 429 провайдер заблокирован дольше, чем можно ждать: слот точно не достанется
+            REJECTED.inc(provider=self.name, priority=PRIORITY_NAMES[level])
+            raise RateLimited(f"{self.name}: лимит исчерпан, пауза ещё {self.blocked_until - started:.0f} с",
+                              self.blocked_until - started)
+        if not self._waiters and self._take(started):
+            WAIT_SECONDS.observe(0.0, provider=self.name, priority=PRIORITY_NAMES[level])
+            return
+
+        future = loop.create_future()
+        heapq.heappush(self._waiters, (level, next(self._seq), future))
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._dispatch())
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            REJECTED.inc(provider=self.name, priority=PRIORITY_NAMES[level])
+            raise RateLimited(f"{self.name}: нет свободного слота за {timeout:.0f} с",
+                              self.retry_after(time.monotonic()))
+        finally:
+            WAIT_SECONDS.observe(time.monotonic() - started, provider=self.name, priority=PRIORITY_NAMES[level])
+
+    async def _dispatch(self):
+        """Раздаёт токены ожидающим по мере пополнения корзины."""
+        while self._waiters:
+            if self._waiters[0][2].done():  # ожидающий ушёл по таймауту
+                heapq.heappop(self._waiters)
+                continue
+            now = time.monotonic()
+            if self._take(now):
+                heapq.heappop(self._waiters)[2].set_result(None)
+                continue
+            await asyncio.sleep(max(self.blocked_until - now, (1 - self.tokens) / self.rate, 0.001))
+
+    def block(self, seconds: float):
+        """Провайдер сообщил о превышении лимита: не отправлять запросы seconds секунд."""
+        self.tokens = 0.0
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+_buckets = {}
+
+def get_bucket(provider: str) -> TokenBucket:
+    bucket = _buckets.get(provider)
+    if bucket is None:
+        per_minute, burst = RATE_LIMITS[provider]
+        bucket = _buckets[provider] = TokenBucket(provider, per_minute, burst)
+    return bucket
+
+@asynccontextmanager
+async def limited(provider: str):
+    """
+    Дождаться слота провайдера. Фоновые запросы ждут сколько нужно, остальные —
+    не дольше RATE_LIMIT_MAX_WAIT_SECONDS, затем RateLimited.
+    """
+    timeout = None if _priority.get() == BACKGROUND else RATE_LIMIT_MAX_WAIT_SECONDS
+    await get_bucket(provider).acquire(timeout)
+    yield
+
+def _header_float(headers, name):
+    try:
+        return float(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def note_response(provider: str, status: int, headers=None):
+    """Учесть квоту из ответа: 429 блокирует провайдера, заголовки обновляют остаток."""
+    bucket = get_bucket(provider)
+    headers = headers or {}
+    # Twelve Data: кредиты текущей минуты; Binance: использованный вес за минуту
+    remaining = _header_float(headers, "api-credits-left")
+    if remaining is not None:
+        bucket.quota_remaining = remaining
+    for name in ("api-credits-used", "x-mbx-used-weight-1m"):
+        used = _header_float(headers, name)
+        if used is not None:
+            bucket.quota_used = used
+
+    if status == 429 or (remaining is not None and remaining <= 0):
+        retry_after = _header_float(headers, "retry-after")
+        # Минутные квоты Twelve Data сбрасываются в начале следующей минуты
+        wait = retry_after if retry_after is not None else 60 - time.time() % 60
+        bucket.block(wait)
+        if status == 429:
+            THROTTLED.inc(provider=provider)
+            logging.warning(f"{provider}: превышен лимит запросов, пауза {wait:.0f} с")
+
+@register_collector
+def _bucket_metrics():
+    # Вызывается из потока /metrics: только чтение, состояние корзин меняет лишь event loop
+    buckets = sorted(_buckets.items())
+    now = time.monotonic()
+    return [
+        ("bot_rate_limit_tokens", "Свободных слотов в лимите провайдера", "gauge",
+         [({"provider": name}, b._available(now)) for name, b in buckets]),
+        ("bot_rate_limit_queue", "Запросов в очереди лимита", "gauge",
+         [({"provider": name, "priority": PRIORITY_NAMES[level]}, n)
+          for name, b in buckets for level, n in b.queued().items()]),
+        ("bot_rate_limit_quota_remaining", "Остаток квоты за минуту по заголовкам провайдера", "gauge",
+         [({"provider": name}, b.quota_remaining) for name, b in buckets if b.quota_remaining is not None]),
+        ("bot_rate_limit_quota_used", "Использовано квоты за минуту (кредиты / вес запросов)", "gauge",
+         [({"provider": name}, b.quota_used) for name, b in buckets if b.quota_used is not None]),
+    ]
@@ -0,0 +1,95 @@
+# startup_report.py
+"""
+Стоимость импорта при старте бота по модулям (python -X importtime в отдельном процессе).
+
+    python startup_report.py                   # таблица для main
+    python startup_report.py --top 30 --output startup.json
+    python startup_report.py --module predictor
+
+Код выхода 1, если при старте загрузился модуль из LAZY_MODULES: они должны
+подгружаться только при первом скриншоте (cv2) или первом обращении к модели.
+"""
+import argparse
+import json
+import re
+import subprocess
+import sys
+import time
+
+LAZY_MODULES = ("cv2", "sklearn", "joblib", "pandas")
+
+_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+def measure(module: str) -> list:
+    """[(модуль, вложенность, self_us, cumulative_us), ...] в порядке завершения импорта."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} завершился с ошибкой:\n{proc.stderr[-2000:]}")
+    rows = []
+    for line in proc.stderr.splitlines():
+        m = _LINE.match(line)
+        if m:
+            rows.append((m.group(4), (len(m.group(3)) - 1) // 2, int(m.group(1)), int(m.group(2))))
+    return rows
+
+def report(module: str, top: int = 20) -> dict:
+    started = time.perf_counter()
+    rows = measure(module)
+    wall = time.perf_counter() - started
+
+    target = next((r for r in rows if r[0] == module and r[1] == 0), None)
+    # Прямые импорты модуля: вложенность 1 под ним
+    direct = []
+    depth0_seen = False
+    for name, depth, self_us, cum_us in reversed(rows):
+        if depth == 0:
+            depth0_seen = name == module
+            continue
+        if depth0_seen and depth == 1:
+            direct.append((name, cum_us))
+    packages = {}
+    for name, _, self_us, _ in rows:
+        root = name.split(".")[0]
+        packages[root] = packages.get(root, 0) + self_us
+
+    return {
+        "module": module,
+        "python": sys.version.split()[0],
+        "process_seconds": round(wall, 3),
+        "import_ms": round(target[3] / 1000, 1) if target else None,
+        "direct_imports_ms": {n: round(us / 1000, 1) for n, us in sorted(direct, key=lambda r: -r[1])},
+        "packages_ms": {n: round(us / 1000, 1) for n, us in sorted(packages.items(), key=lambda r: -r[1])[:top]},
+        "lazy_loaded_at_startup": sorted({r[0].split(".")[0] for r in rows} & set(LAZY_MODULES)),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Стоимость импорта при старте по модулям")
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--top", type=int, default=20, help="сколько пакетов показать")
+    parser.add_argument("--output", help="куда записать отчёт (JSON)")
+    args = parser.parse_args(argv)
+
+    res = report(args.module, args.top)
+    print(f"import {res['module']}: {res['import_ms']} ms (процесс целиком {res['process_seconds']} с)")
+    print("\nПрямые импорты:")
+    for name, ms in res["direct_imports_ms"].items():
+        print(f"  {name:<30} {ms:>10.1f} ms")
+    print("\nПакеты (собственное время):")
+    for name, ms in res["packages_ms"].items():
+        print(f"  {name:<30} {ms:>10.1f} ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(res, f, indent=2, ensure_ascii=False)
+        print(f"\nОтчёт записан в {args.output}")
+
+    if res["lazy_loaded_at_startup"]:
+        print(f"\nПри старте загружены отложенные модули: {', '.join(res['lazy_loaded_at_startup'])}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
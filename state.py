@@ -1,36 +1,190 @@
 import time
 import asyncio
+import heapq
+import logging
+import sys
+from collections import OrderedDict
+
+from config import STATE_SHARDS, STATE_SWEEP_SECONDS, STATE_MAX_BYTES, STATE_LARGE_VALUE_BYTES
+from metrics import Counter, register_collector
+
+EVICTIONS = Counter("bot_state_evictions_total", "Удалённые записи состояния пользователей", ("store", "reason"))
+
+def value_size(val) -> int:
+    """Примерный размер значения в байтах (bytes / массивы NumPy — по содержимому)."""
+    if isinstance(val, (bytes, bytearray, memoryview)):
+        return len(val)
+    if isinstance(val, tuple):
+        return sys.getsizeof(val) + sum(value_size(v) for v in val)
+    nbytes = getattr(val, "nbytes", None)
+    if isinstance(nbytes, int):
+        return nbytes
+    return sys.getsizeof(val)
+
+
+class _Entry:
+    __slots__ = ("expires", "values", "sizes", "touched")
+
+    def __init__(self):
+        self.expires = 0.0
+        self.values = {}
+        self.sizes = {}
+        self.touched = 0
+
+    @property
+    def size(self):
+        return sum(self.sizes.values())
+
+
+class _Shard:
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.entries = OrderedDict()  # uid -> _Entry, от давно не трогавших к недавним
+
 
 class TTLState:
-    def __init__(self, ttl):
+    """
+    Состояние диалога по пользователям с временем жизни ttl секунд с последнего set.
+    Пользователи разложены по шардам со своими блокировками; просроченные записи удаляет
+    фоновая задача (start_sweeper), а при превышении max_bytes первыми удаляются крупные
+    значения (скриншоты) давно не активных пользователей, затем записи целиком.
+    """
+
+    def __init__(self, ttl, name="dialog", shards=STATE_SHARDS, max_bytes=STATE_MAX_BYTES,
+                 large_value_bytes=STATE_LARGE_VALUE_BYTES):
         self.ttl = ttl
-        self.data = {}
-        self.lock = asyncio.Lock()
+        self.name = name
+        self.max_bytes = max_bytes
+        self.large_value_bytes = large_value_bytes
+        self._shards = [_Shard() for _ in range(max(1, shards))]
+        self._clock = 0
+        self.bytes = 0
+        self._sweeper = None
+        register_collector(self._metrics)
+
+    def _shard(self, uid) -> _Shard:
+        return self._shards[hash(uid) % len(self._shards)]
+
+    def _drop(self, shard, uid, reason=None):
+        entry = shard.entries.pop(uid, None)
+        if entry is not None:
+            self.bytes -= entry.size
+            if reason:
+                EVICTIONS.inc(store=self.name, reason=reason)
+
+    def _live(self, shard, uid):
+        entry = shard.entries.get(uid)
+        if entry is not None and entry.expires < time.time():
+            self._drop(shard, uid, "expired")
+            return None
+        return entry
 
     async def set(self, uid, key, val):
-        async with self.lock:
-            if uid not in self.data:
-                self.data[uid] = {"_exp": time.time() + self.ttl}
-            self.data[uid]["_exp"] = time.time() + self.ttl
-            self.data[uid][key] = val
+        shard = self._shard(uid)
+        async with shard.lock:
+            entry = self._live(shard, uid)
+            if entry is None:
+                entry = shard.entries[uid] = _Entry()
+            # ttl одинаковый для всех, поэтому порядок касаний — это и порядок истечения
+            shard.entries.move_to_end(uid)
+            self._clock += 1
+            entry.touched = self._clock
+            entry.expires = time.time() + self.ttl
+            size = value_size(val)
+            self.bytes += size - entry.sizes.get(key, 0)
+            entry.values[key] = val
+            entry.sizes[key] = size
+        if self.bytes > self.max_bytes:
+            self._enforce_budget(keep=uid)
 
     async def get(self, uid, key):
-        async with self.lock:
-            if uid not in self.data:
-                return None
-            d = self.data[uid]
-            if d["_exp"] < time.time():
-                del self.data[uid]
-                return None
-            return d.get(key)
+        shard = self._shard(uid)
+        async with shard.lock:
+            entry = self._live(shard, uid)
+            return entry.values.get(key) if entry is not None else None
 
     async def clear(self, uid):
-        async with self.lock:
-            self.data.pop(uid, None)
+        shard = self._shard(uid)
+        async with shard.lock:
+            self._drop(shard, uid)
 
     async def get_all(self, uid):
-        async with self.lock:
-            if uid not in self.data or self.data[uid]["_exp"] < time.time():
-                self.data.pop(uid, None)
-                return {}
-            return {k: v for k, v in self.data[uid].items() if k != "_exp"}
+        shard = self._shard(uid)
+        async with shard.lock:
+            entry = self._live(shard, uid)
+            return dict(entry.values) if entry is not None else {}
+
+    def _lru(self):
+        """(touched, uid, shard) всех записей от давно не активных к недавним: шарды уже упорядочены."""
+        def ordered(shard):
+            for uid, entry in shard.entries.items():
+                yield entry.touched, uid, shard
+        return heapq.merge(*(ordered(shard) for shard in self._shards))
+
+    def _enforce_budget(self, keep=None):
+        """
+        Уложиться в max_bytes. Выполняется без await, поэтому в event loop атомарна
+        относительно остальных операций и не берёт блокировки шардов.
+        """
+        for _, uid, shard in self._lru():
+            if self.bytes <= self.max_bytes:
+                return
+            if uid == keep:
+                continue
+            entry = shard.entries[uid]
+            for key, size in list(entry.sizes.items()):
+                if size >= self.large_value_bytes:
+                    del entry.values[key], entry.sizes[key]
+                    self.bytes -= size
+                    EVICTIONS.inc(store=self.name, reason="large_value")
+
+        excess, victims = self.bytes - self.max_bytes, []
+        for _, uid, shard in self._lru():
+            if excess <= 0:
+                break
+            if uid != keep:
+                victims.append((uid, shard))
+                excess -= shard.entries[uid].size
+        for uid, shard in victims:
+            self._drop(shard, uid, "memory")
+
+    def sweep(self) -> int:
+        """Удалить просроченные записи; в каждом шарде они лежат в начале порядка касаний."""
+        now = time.time()
+        removed = 0
+        for shard in self._shards:
+            while shard.entries:
+                uid, entry = next(iter(shard.entries.items()))
+                if entry.expires >= now:
+                    break
+                self._drop(shard, uid, "expired")
+                removed += 1
+        return removed
+
+    async def _sweep_loop(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                removed = self.sweep()
+                if removed:
+                    logging.debug(f"Состояние: удалено {removed} просроченных записей")
+            except Exception as e:
+                logging.error(f"Очистка состояния: {e}")
+
+    def start_sweeper(self, interval=STATE_SWEEP_SECONDS):
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.get_running_loop().create_task(self._sweep_loop(interval))
+
+    def stop_sweeper(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+
+    def __len__(self):
+        return sum(len(shard.entries) for shard in self._shards)
+
+    def _metrics(self):
+        return [
+            ("bot_state_entries", "Пользователей с активным состоянием", "gauge", [({"store": self.name}, len(self))]),
+            ("bot_state_bytes", "Примерный объём состояния пользователей", "gauge", [({"store": self.name}, self.bytes)]),
+        ]
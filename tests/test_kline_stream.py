@@ -0,0 +1,153 @@
+# tests/test_kline_stream.py
+"""
+KlineStream против локального WebSocket-сервера вместо stream.binance.com: подключение
+с догрузкой через REST, сообщения потока, догрузка пропуска, переход на REST при
+молчании потока и после разрыва соединения.
+"""
+import asyncio
+
+import numpy as np
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import kline_stream
+from candle_array import from_columns
+from kline_stream import RingBuffer, start_stream, stop_stream, stream_candles
+
+STEP = 60
+
+
+def bars(times, close=1.0):
+    times = np.asarray(times, dtype=np.int64)
+    c = np.full(len(times), float(close))
+    return from_columns(open=c, high=c + 1, low=c - 1, close=c, volume=np.ones(len(times)), time=times)
+
+
+def kline(t, close, symbol="BTCUSDT"):
+    return {
+        "stream": f"{symbol.lower()}@kline_1m",
+        "data": {"e": "kline", "k": {
+            "t": t * 1000, "s": symbol, "o": str(close), "h": str(close + 1),
+            "l": str(close - 1), "c": str(close), "v": "1",
+        }},
+    }
+
+
+class FakeBinance:
+    """WebSocket-сервер потока: сообщения отправляет сам тест через принятые соединения."""
+
+    def __init__(self):
+        self.connections = asyncio.Queue()
+        self.paths = []
+
+    async def handler(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.paths.append(request.path_qs)
+        await self.connections.put(ws)
+        async for _ in ws:
+            pass
+        return ws
+
+
+class Backfill:
+    """REST-догрузка: отдаёт последние limit баров «биржевой» истории history."""
+
+    def __init__(self, history):
+        self.history = history
+        self.calls = []
+
+    async def __call__(self, symbol, interval, limit):
+        self.calls.append((symbol, interval, limit))
+        return self.history[-limit:]
+
+
+async def wait_until(predicate, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "условие не выполнилось"
+        await asyncio.sleep(0.01)
+
+
+def served_times(limit=None):
+    candles = stream_candles("BTCUSD", "1m", limit)
+    return None if candles is None else candles["time"].tolist()
+
+
+def test_ring_buffer_push_replace_and_load():
+    buf = RingBuffer(3)
+    for t in (0, 60, 120, 180):
+        buf.push((t, 1.0, 2.0, 0.5, 1.5, 1.0))
+    assert buf.snapshot()["time"].tolist() == [60, 120, 180]
+
+    buf.push((180, 1.0, 2.0, 0.5, 9.0, 1.0))  # тот же бар — обновление
+    buf.push((60, 1.0, 2.0, 0.5, 1.5, 1.0))   # старый бар пропускается
+    assert buf.snapshot()["close"].tolist() == [1.5, 1.5, 9.0]
+
+    buf.load(bars([0, 60, 120]))  # бар 180 из потока новее истории и остаётся
+    assert buf.snapshot()["time"].tolist() == [60, 120, 180]
+    assert buf.snapshot(2)["time"].tolist() == [120, 180]
+
+
+def test_stream_against_local_server(monkeypatch):
+    async def scenario():
+        fake = FakeBinance()
+        app = web.Application()
+        app.router.add_get("/stream", fake.handler)
+        server = TestServer(app)
+        await server.start_server()
+        backfill = Backfill(bars(np.arange(10) * STEP))
+        task = None
+        try:
+            stream = start_stream(["BTCUSD"], interval="1m", capacity=100,
+                                  url=str(server.make_url("/")), backfill=backfill)
+            task = kline_stream._task
+
+            # Подключение: подписка на нужный поток и догрузка истории через REST
+            ws = await asyncio.wait_for(fake.connections.get(), 5)
+            assert fake.paths == ["/stream?streams=btcusdt@kline_1m"]
+            await wait_until(lambda: served_times() is not None)
+            assert backfill.calls == [("BTCUSDT", "1m", 100)]
+            assert served_times() == list(range(0, 10 * STEP, STEP))
+
+            # Сообщения: новый бар добавляется, обновление формирующегося — заменяет его
+            await ws.send_json(kline(10 * STEP, 2.0))
+            await wait_until(lambda: served_times()[-1] == 10 * STEP)
+            await ws.send_json(kline(10 * STEP, 3.0))
+            await wait_until(lambda: stream_candles("BTCUSD", "1m", 1)["close"][0] == 3.0)
+            assert len(served_times()) == 11
+
+            # Пропуск баров 11..13: до догрузки свечи из памяти не отдаются, после — ряд без дыр
+            backfill.history = bars(np.arange(15) * STEP)
+            await ws.send_json(kline(14 * STEP, 4.0))
+            await wait_until(lambda: len(backfill.calls) == 2)
+            await wait_until(lambda: served_times() is not None)
+            assert served_times() == list(range(0, 15 * STEP, STEP))
+            assert served_times(3) == [12 * STEP, 13 * STEP, 14 * STEP]
+
+            # Поток молчит дольше KLINE_STREAM_STALE_SECONDS — data_provider идёт в REST
+            monkeypatch.setattr(kline_stream, "KLINE_STREAM_STALE_SECONDS", 0.2)
+            await asyncio.sleep(0.3)
+            assert served_times() is None
+            await ws.send_json(kline(14 * STEP, 4.5))
+            await wait_until(lambda: served_times() is not None)
+
+            # Разрыв: сразу REST, после переподключения — снова догрузка и память
+            monkeypatch.setattr(kline_stream, "KLINE_STREAM_STALE_SECONDS", 30.0)
+            await ws.close()
+            await wait_until(lambda: not stream.connected)
+            assert served_times() is None
+            await asyncio.wait_for(fake.connections.get(), 5)
+            await wait_until(lambda: served_times() is not None)
+            assert len(backfill.calls) == 3
+
+            # Неподписанные символы и другие интервалы поток не обслуживает
+            assert stream_candles("ETHUSD", "1m", 10) is None
+            assert stream_candles("BTCUSD", "5m", 10) is None
+        finally:
+            stop_stream()
+            if task is not None:
+                await asyncio.gather(task, return_exceptions=True)
+            await server.close()
+
+    asyncio.run(scenario())
@@ -1,10 +1,14 @@
 # train_models.py
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
 import numpy as np
-import pandas as pd
+from joblib import parallel_config
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import classification_report
 from sklearn.utils import resample
-import joblib
 import os
 import logging
 
@@ -13,115 +17,223 @@ from sklearn.model_selection import train_test_split, GridSearchCV  # Новый
 logging.basicConfig(level=logging.INFO)
 
 # Теперь импортируем правильно и используем символы с USD (как в боте)
-from binance_data import get_candles as get_candles_binance
-
-# Таймфреймы
+from features import build_features
+from candle_array import as_candles, resample as resample_candles
+from kline_downloader import sync_pairs
+import kline_store
+from http_client import close_http_clients
+from model import save_model
+from bar_cache import interval_seconds
+from config import BASE_INTERVAL, TRAIN_CPU_BUDGET
+
+# Таймфреймы (в минутах): все собираются из одной истории BASE_INTERVAL на символ
 TIMEFRAMES = ["1", "2", "5", "10"]
-INTERVALS = {"1": "1m", "2": "2m", "5": "5m", "10": "10m"}
 
 # Символы в формате, как в твоём боте: с USD (функция в binance_data.py сама заменит на USDT)
 SYMBOLS = ["BTCUSD", "ETHUSD", "BNBUSD", "SOLUSD", "XRPUSD", "ADAUSD", "DOGEUSD"]
 
 PROFIT_THRESHOLD = 0.20  # Настроил выше для скальпинга
-LIMIT = 10000  # Больше данных
+LIMIT = 10000  # Больше данных (грузится постранично, по 1000 за запрос)
 
 MODEL_DIR = "models"
 os.makedirs(MODEL_DIR, exist_ok=True)
 
-def prepare_data(candles, tf):
+def make_labels(closes, horizons=(2,), threshold=PROFIT_THRESHOLD):
+    """
+    Метки 1 (рост) / 0 (нейтрал) / -1 (падение) по изменению цены через h баров, в %.
+    Строка r соответствует строке r из build_features, т.е. свече r + 1;
+    последняя свеча не участвует (может быть незакрытой).
+    Возвращает массив (len(closes) - 2 - max(horizons), len(horizons)).
+    """
+    closes = np.asarray(closes, dtype=float)
+    rows = max(len(closes) - 2 - max(horizons), 0)
+    current = closes[1:1 + rows]
+    labels = np.empty((rows, len(horizons)), dtype=np.int8)
+    for j, h in enumerate(horizons):
+        change_pct = (closes[1 + h:1 + h + rows] - current) / current * 100
+        labels[:, j] = np.where(change_pct > threshold, 1, np.where(change_pct < -threshold, -1, 0))
+    return labels
+
+def prepare_data(candles, tf, horizons=(2,), threshold=PROFIT_THRESHOLD):
     if len(candles) < 50:
         return None, None
 
-    df = pd.DataFrame(candles)
+    candles = as_candles(candles)
     X_raw = build_features(candles, tf)  # Теперь с индикаторами!
-    y = []
-
-    for i in range(len(df) - 4):
-        current = df.iloc[i + 1]
-        future_close = df.iloc[i + 3]["close"]
-        price_change_pct = (future_close - current["close"]) / current["close"] * 100
-        
-        if price_change_pct > PROFIT_THRESHOLD:
-            label = 1  # Рост
-        elif price_change_pct < -PROFIT_THRESHOLD:
-            label = -1  # Падение
-        else:
-            label = 0  # Нейтрал
-        y.append(label)
-
-    return X_raw[:len(y)], np.array(y)  # Align lengths
-
-def train_and_save():
-    for tf in TIMEFRAMES:
-        print(f"\n=== Обучение модели для {tf}-минутного таймфрейма ===")
-        interval = INTERVALS[tf]
-        all_X = []
-        all_y = []
-
-        for symbol in SYMBOLS:
+    y = make_labels(candles["close"], horizons, threshold)
+    if len(horizons) == 1:
+        y = y[:, 0]
+
+    return X_raw[:len(y)], y  # Align lengths
+
+PARAM_GRID = {
+    'n_estimators': [400, 600],
+    'max_depth': [10, 12],
+    'min_samples_split': [8, 10]
+}
+
+@contextmanager
+def stage(name, timings):
+    """Печать начала/конца стадии и её длительности в timings."""
+    print(f"\n>>> {name}")
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = time.perf_counter() - started
+        print(f"<<< {name}: {timings[name]:.1f} с")
+
+def cpu_plan(jobs, budget=TRAIN_CPU_BUDGET):
+    """
+    (сколько таймфреймов обучать одновременно, ядер на каждый).
+    Параллелится только перебор параметров; сами леса внутри перебора — в один поток,
+    так что уровни не делят одни и те же ядра.
+    """
+    budget = max(1, budget)
+    parallel = max(1, min(jobs, budget))
+    return parallel, max(1, budget // parallel)
+
+def base_factor(tf):
+    """Сколько баров BASE_INTERVAL в одном баре таймфрейма tf."""
+    return int(tf) * 60 // interval_seconds(BASE_INTERVAL)
+
+def load_candles(symbol, tf, bars=None):
+    """
+    Последние bars баров таймфрейма tf из хранилища: бары собираются из истории
+    BASE_INTERVAL (resample), как и в боте, поэтому все таймфреймы согласованы.
+    """
+    factor = base_factor(tf)
+    base = kline_store.load(symbol, BASE_INTERVAL)
+    if bars:
+        base = base[-(bars + 1) * factor:]  # +1 бар на неполный первый
+    candles = resample_candles(base, int(tf) * 60)  # memmap как есть: читаются только нужные страницы
+    return candles[-bars:] if bars else candles
+
+async def download_candles(symbols, timeframes):
+    """Догрузка истории BASE_INTERVAL, достаточной для LIMIT баров старшего из timeframes."""
+    bars = (LIMIT + 1) * max(base_factor(tf) for tf in timeframes)
+    try:
+        return await sync_pairs([(s, BASE_INTERVAL) for s in symbols], bars=bars)
+    finally:
+        await close_http_clients()
+
+def symbol_features(symbol, tf):
+    """Признаки одного символа из хранилища (выполняется в пуле процессов)."""
+    # Обучаемся на последних LIMIT барах из хранилища (memmap, без сети)
+    candles = load_candles(symbol, tf, LIMIT)
+    if len(candles) < 100:
+        return None, None, f"мало свечей ({len(candles)})"
+    X, y = prepare_data(np.array(candles), tf)
+    return X, y, None
+
+def build_datasets(symbols, timeframes, workers):
+    """{tf: (X, y)} — признаки всех символов в пуле процессов, склейка в порядке symbols."""
+    parts = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(symbol_features, s, tf): (s, tf) for tf in timeframes for s in symbols}
+        for done, future in enumerate(as_completed(futures), 1):
+            symbol, tf = futures[future]
             try:
-                logging.info(f"Загрузка {symbol} {interval}...")
-                # Здесь binance_data.py сам заменит USD → USDT
-                candles = get_candles_binance(symbol, interval=interval, limit=LIMIT)
-                if len(candles) < 100:
-                    print(f"  {symbol}: мало свечей ({len(candles)})")
-                    continue
-
-                X, y = prepare_data(candles, tf)
-                if X is not None and len(X) > 0:
-                    all_X.extend(X)
-                    all_y.extend(y)
-                    print(f"  {symbol}: +{len(X)} примеров (всего: {len(all_X)})")
+                X, y, problem = future.result()
             except Exception as e:
-                logging.error(f"Ошибка с {symbol}: {e}")
-                print(f"  {symbol}: ошибка — {e}")
-
-        if len(all_X) < 500:
+                X, y, problem = None, None, f"ошибка — {e}"
+                logging.error(f"Ошибка с {symbol} {tf}m: {e}")
+            parts[(symbol, tf)] = (X, y)
+            status = problem or f"+{len(X)} примеров"
+            print(f"  [{done}/{len(futures)}] {symbol} {tf}m: {status}")
+
+    datasets = {}
+    for tf in timeframes:
+        chunks = [parts[(s, tf)] for s in symbols if parts[(s, tf)][0] is not None and len(parts[(s, tf)][0])]
+        if chunks:
+            datasets[tf] = (np.concatenate([X for X, _ in chunks]), np.concatenate([y for _, y in chunks]))
+    return datasets
+
+def balance(X, y):
+    """Балансировка (multiclass): каждый класс дополняется с повторами до самого частого."""
+    classes = np.unique(y)
+    max_count = max(np.sum(y == c) for c in classes)
+    X_bal = np.concatenate([resample(X[y == c], replace=True, n_samples=max_count, random_state=42) for c in classes])
+    y_bal = np.concatenate([np.full(max_count, c) for c in classes])
+    return X_bal, y_bal
+
+def train_timeframe(tf, X, y, n_jobs):
+    started = time.perf_counter()
+    X_bal, y_bal = balance(X, y)
+
+    # Split
+    X_train, X_test, y_train, y_test = train_test_split(X_bal, y_bal, test_size=0.2, random_state=42)
+
+    # Тюнинг params (lite grid search): n_jobs — у перебора, деревья каждого кандидата в один поток
+    rf = RandomForestClassifier(class_weight="balanced", random_state=42, n_jobs=1)
+    grid = GridSearchCV(rf, PARAM_GRID, cv=3, scoring='f1_macro', n_jobs=n_jobs, refit=False)
+    grid.fit(X_train, y_train)
+    print(f"  {tf}m: перебор параметров {time.perf_counter() - started:.1f} с, best params: {grid.best_params_}")
+
+    # Финальная модель — на всех ядрах задачи
+    model = RandomForestClassifier(class_weight="balanced", random_state=42, n_jobs=n_jobs, **grid.best_params_)
+    model.fit(X_train, y_train)
+    model.set_params(n_jobs=-1)  # как раньше: большие пакеты в боте предсказываются на всех ядрах
+
+    preds = model.predict(X_test)
+    report = classification_report(y_test, preds)
+
+    # Сохранение
+    path = os.path.join(MODEL_DIR, f"model_{tf}m.joblib")
+    save_model(model, path)  # атомарно: бот подхватит новую версию без перезапуска
+    return path, report, time.perf_counter() - started
+
+def train_timeframe_process(tf, X, y, n_jobs):
+    """
+    train_timeframe в отдельном процессе. Пул воркеров joblib (loky) один на процесс:
+    переборы из потоков одного процесса делили бы одни и те же n_jobs воркеров.
+    """
+    # Без короткого idle_worker_timeout процесс при выходе ждёт простаивающих воркеров 300 с
+    with parallel_config(backend="loky", idle_worker_timeout=1):
+        return train_timeframe(tf, X, y, n_jobs)
+
+def train_and_save(timeframes=TIMEFRAMES, symbols=SYMBOLS, cpu_budget=TRAIN_CPU_BUDGET):
+    timings = {}
+    total_started = time.perf_counter()
+
+    with stage("Загрузка истории", timings):
+        downloaded = asyncio.run(download_candles(symbols, timeframes))
+        for (symbol, interval), res in downloaded.items():
+            if isinstance(res, Exception):
+                logging.error(f"Не удалось обновить {symbol} {interval}: {res}")
+
+    with stage("Признаки", timings):
+        datasets = build_datasets(symbols, timeframes, workers=max(1, cpu_budget))
+
+    ready = [tf for tf in timeframes if tf in datasets and len(datasets[tf][0]) >= 500]
+    for tf in timeframes:
+        if tf not in ready:
             print(f"Недостаточно данных для {tf}m — пропускаем")
-            continue
-
-        X = np.array(all_X)
-        y = np.array(all_y)
-
-        # Балансировка (multiclass)
-        classes = np.unique(y)
-        max_count = max(np.sum(y == c) for c in classes)
-        X_bal = []
-        y_bal = []
-        for c in classes:
-            X_c = X[y == c]
-            y_c = y[y == c]
-            X_bal.extend(resample(X_c, replace=True, n_samples=max_count, random_state=42))
-            y_bal.extend([c] * max_count)
-
-        X_bal = np.array(X_bal)
-        y_bal = np.array(y_bal)
-
-        # Split
-        X_train, X_test, y_train, y_test = train_test_split(X_bal, y_bal, test_size=0.2, random_state=42)
-
-        # Тюнинг params (lite grid search)
-        param_grid = {
-            'n_estimators': [400, 600],
-            'max_depth': [10, 12],
-            'min_samples_split': [8, 10]
-        }
-        rf = RandomForestClassifier(class_weight="balanced", random_state=42, n_jobs=-1)
-        grid = GridSearchCV(rf, param_grid, cv=3, scoring='f1_macro')
-        grid.fit(X_train, y_train)
-
-        model = grid.best_estimator_
-        print(f"Best params: {grid.best_params_}")
-
-        preds = model.predict(X_test)
-        print(f"\n{tf}m — Результат (на тестовой выборке):")
-        print(classification_report(y_test, preds))
-
-        # Сохранение
-        path = os.path.join(MODEL_DIR, f"model_{tf}m.joblib")
-        joblib.dump(model, path)
-        print(f"Модель сохранена: {path}\n")
 
+    parallel, per_job = cpu_plan(len(ready), cpu_budget)
+    with stage("Обучение", timings):
+        print(f"  бюджет {cpu_budget} ядер: одновременно таймфреймов — {parallel}, ядер на каждый — {per_job}")
+        # Таймфрейм — процесс со своим пулом joblib на per_job ядер. spawn: процесс завершается
+        # через sys.exit, и joblib успевает удалить свои временные memmap-папки
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=parallel, mp_context=context) as pool:
+            futures = {pool.submit(train_timeframe_process, tf, *datasets[tf], per_job): tf for tf in ready}
+            for future in as_completed(futures):
+                tf = futures[future]
+                try:
+                    path, report, seconds = future.result()
+                except Exception as e:
+                    logging.error(f"Обучение {tf}m не удалось: {e}")
+                    continue
+                timings[f"  обучение {tf}m"] = seconds
+                print(f"\n{tf}m — Результат (на тестовой выборке), {seconds:.1f} с:")
+                print(report)
+                print(f"Модель сохранена: {path}\n")
+
+    print("\nВремя по стадиям:")
+    for name, seconds in timings.items():
+        print(f"  {name:<20} {seconds:>8.1f} с")
+    print(f"  {'Всего':<20} {time.perf_counter() - total_started:>8.1f} с")
     print("Обучение всех моделей завершено! Модели лежат в папке 'models/'")
 
 if __name__ == "__main__":
@@ -1,7 +1,8 @@
 import numpy as np
+from candle_array import as_candles
 
 def market_regime(candles):
-    closes = np.array([c["close"] for c in candles])
+    closes = as_candles(candles)["close"]
     returns = np.diff(closes) / closes[:-1]
 
     vol = np.std(returns)
@@ -15,7 +16,7 @@ def market_regime(candles):
 
 
 def trend_signal(candles):
-    closes = np.array([c["close"] for c in candles])
+    closes = as_candles(candles)["close"]
     ma_fast = closes[-5:].mean()
     ma_slow = closes[-20:].mean()
 
@@ -24,3 +25,42 @@ def trend_signal(candles):
     elif ma_fast < ma_slow:
         return 0.35
     return 0.5
+
+
+def _trailing_mean(x, period):
+    """
+    Среднее последних period значений на каждом баре (в начале — по всем доступным).
+    Тем же np.mean по окну, что и trend_signal: разность кумулятивных сумм на ровных
+    ценах даёт ma_fast != ma_slow там, где скалярная версия видит равенство.
+    """
+    out = np.empty(len(x))
+    for i in range(min(period - 1, len(x))):
+        out[i] = x[:i + 1].mean()
+    if len(x) >= period:
+        out[period - 1:] = np.lib.stride_tricks.sliding_window_view(x, period).mean(axis=-1)
+    return out
+
+
+def trend_signal_series(candles):
+    """trend_signal для каждого бара истории за один проход."""
+    closes = np.asarray(as_candles(candles)["close"], dtype=float)
+    ma_fast = _trailing_mean(closes, 5)
+    ma_slow = _trailing_mean(closes, 20)
+    return np.where(ma_fast > ma_slow, 0.65, np.where(ma_fast < ma_slow, 0.35, 0.5))
+
+
+def market_regime_series(candles, window=70):
+    """
+    market_regime по скользящему окну из window последних свечей для каждого бара.
+    До заполнения окна — пустая строка.
+    """
+    closes = np.asarray(as_candles(candles)["close"], dtype=float)
+    out = np.full(len(closes), "", dtype="<U8")
+    if len(closes) < window:
+        return out
+    w = np.lib.stride_tricks.sliding_window_view(closes, window)
+    vol = np.std(np.diff(w, axis=1) / w[:, :-1], axis=1)
+    x = np.arange(window) - (window - 1) / 2
+    slope = w @ x / (x @ x)  # МНК-наклон, как polyfit(range(window), closes, 1)[0]
+    out[window - 1:] = np.where(vol < 0.001, "flat", np.where(np.abs(slope) > vol * 2, "trend", "volatile"))
+    return out
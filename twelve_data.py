@@ -1,48 +1,59 @@
-import requests
+import httpx
 import logging
-from typing import List, Dict, Optional
+import numpy as np
+from datetime import datetime, timezone
+from typing import Optional
 from config import TWELVE_DATA_API_KEY
+from candle_array import from_columns
+from http_client import get_http_client
+from metrics import provider_call, PROVIDER_ERRORS
+from rate_limiter import limited, note_response, RateLimited
 
 class TwelveDataClient:
     def __init__(self, api_key: str):
         self.api_key = api_key
         self.base_url = "https://api.twelvedata.com"
-        self.session = requests.Session()
-        self.session.params = {"apikey": api_key}
 
-    def get_candles(self, symbol: str, interval: str, outputsize: int = 50) -> Optional[List[Dict]]:
+    async def get_candles(self, symbol: str, interval: str, outputsize: int = 50) -> Optional[np.ndarray]:
         try:
             url = f"{self.base_url}/time_series"
             params = {
                 "symbol": symbol,
                 "interval": interval,
                 "outputsize": outputsize,
-                "format": "JSON"
+                "timezone": "UTC",
+                "format": "JSON",
+                "apikey": self.api_key
             }
             
-            response = self.session.get(url, params=params, timeout=10)
-            response.raise_for_status()
+            async with limited("twelve_data"):
+                with provider_call("twelve_data"):
+                    response = await get_http_client("twelve_data", timeout=10.0).get(url, params=params)
+                    note_response("twelve_data", response.status_code, response.headers)
+                    response.raise_for_status()
             
             data = response.json()
+            if data.get("status") == "error":
+                PROVIDER_ERRORS.inc(provider="twelve_data")
+                if data.get("code") == 429:  # Twelve Data сообщает о превышении лимита с HTTP 200
+                    note_response("twelve_data", 429)
             if "values" not in data or not data["values"]:
                 logging.warning(f"Нет данных для {symbol} {interval}: {data.get('message', 'пустой ответ')}")
                 return None
                 
-            candles = []
-            for candle in data["values"][:outputsize]:
-                candles.append({
-                    "open": float(candle["open"]),
-                    "high": float(candle["high"]),
-                    "low": float(candle["low"]),
-                    "close": float(candle["close"]),
-                    "volume": float(candle.get("volume", 0))
-                })
+            values = data["values"][:outputsize][::-1]  # от старых к новым
+            column = lambda name: np.array([v.get(name, 0) for v in values], dtype=float)
+            return from_columns(
+                open=column("open"), high=column("high"), low=column("low"), close=column("close"),
+                volume=column("volume"),
+                time=[int(datetime.fromisoformat(v["datetime"]).replace(tzinfo=timezone.utc).timestamp()) for v in values],
+            )
             
-            return candles[::-1]  # от старых к новым
-            
-        except requests.exceptions.HTTPError as http_err:
+        except httpx.HTTPStatusError as http_err:
             logging.error(f"Twelve Data HTTP error для {symbol} {interval}: {http_err} | {response.text}")
             return None
+        except RateLimited:
+            raise
         except Exception as e:
             logging.error(f"Twelve Data unexpected error для {symbol} {interval}: {e}")
             return None